@@ -0,0 +1,102 @@
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional
+import hashlib
+import json
+import os
+
+import models
+
+ANALYSIS_CACHE_TTL_SECONDS = int(os.getenv("ANALYSIS_CACHE_TTL_SECONDS", str(24 * 3600)))
+ANALYSIS_CACHE_MAX_ENTRIES = int(os.getenv("ANALYSIS_CACHE_MAX_ENTRIES", "500"))
+
+_DATE_FIELDS = ('start_date', 'end_date')
+
+def hash_notes(notes: List[Dict[str, Any]], params: Dict[str, Any] = None) -> str:
+    """Cache key of notes and analysis parameters"""
+    payload = {
+        'notes': [
+            [note['id'], note.get('updated_at'), note['title'], note['content']]
+            for note in notes
+        ],
+        'params': params or {}
+    }
+    notes_str = json.dumps(payload, sort_keys=True, default=str)
+    return hashlib.md5(notes_str.encode()).hexdigest()
+
+def serialize_moments(moments: List[Dict[str, Any]]) -> str:
+    """Encode analyzer moments as JSON, keeping dates in ISO format"""
+    encoded = []
+    for moment in moments:
+        moment = dict(moment)
+        for field in _DATE_FIELDS:
+            if isinstance(moment[field], datetime):
+                moment[field] = moment[field].isoformat()
+        encoded.append(moment)
+    return json.dumps(encoded)
+
+def deserialize_moments(result: str) -> List[Dict[str, Any]]:
+    """Decode cached moments back into the analyzer output format"""
+    moments = json.loads(result)
+    for moment in moments:
+        for field in _DATE_FIELDS:
+            moment[field] = datetime.fromisoformat(moment[field])
+    return moments
+
+def get_cached_analysis(db: Session, notes_hash: str) -> Optional[List[Dict[str, Any]]]:
+    """Return cached moments for a notes hash, or None on a miss or expired entry"""
+    entry = db.query(models.AnalysisCache).filter(
+        models.AnalysisCache.notes_hash == notes_hash
+    ).first()
+    if entry is None:
+        return None
+
+    now = datetime.utcnow()
+    if entry.created_at < now - timedelta(seconds=ANALYSIS_CACHE_TTL_SECONDS):
+        db.delete(entry)
+        db.commit()
+        return None
+
+    entry.last_accessed_at = now
+    db.commit()
+    return deserialize_moments(entry.result)
+
+def store_analysis(db: Session, notes_hash: str, user_id: int, moments: List[Dict[str, Any]]):
+    """Store analysis results under a notes hash and evict stale entries"""
+    now = datetime.utcnow()
+    entry = db.query(models.AnalysisCache).filter(
+        models.AnalysisCache.notes_hash == notes_hash
+    ).first()
+    if entry is None:
+        entry = models.AnalysisCache(notes_hash=notes_hash, user_id=user_id)
+        db.add(entry)
+    entry.result = serialize_moments(moments)
+    entry.created_at = now
+    entry.last_accessed_at = now
+    try:
+        db.flush()
+    except IntegrityError:
+        # A concurrent analysis of the same notes stored it first
+        db.rollback()
+        return
+
+    evict_analysis_cache(db, now)
+    db.commit()
+
+def evict_analysis_cache(db: Session, now: Optional[datetime] = None):
+    """Drop expired entries, then the least recently used ones beyond the size limit"""
+    now = now or datetime.utcnow()
+    cutoff = now - timedelta(seconds=ANALYSIS_CACHE_TTL_SECONDS)
+    db.query(models.AnalysisCache).filter(
+        models.AnalysisCache.created_at < cutoff
+    ).delete(synchronize_session=False)
+
+    overflow = db.query(models.AnalysisCache).count() - ANALYSIS_CACHE_MAX_ENTRIES
+    if overflow > 0:
+        stale_ids = [row.id for row in db.query(models.AnalysisCache.id).order_by(
+            models.AnalysisCache.last_accessed_at
+        ).limit(overflow)]
+        db.query(models.AnalysisCache).filter(
+            models.AnalysisCache.id.in_(stale_ids)
+        ).delete(synchronize_session=False)
@@ -1,17 +1,48 @@
 import numpy as np
+import scipy.sparse as sp
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.cluster import AgglomerativeClustering
 from sklearn.metrics.pairwise import cosine_similarity
-from textblob import TextBlob
+from textblob.en.sentiments import PatternAnalyzer
 from datetime import datetime, timedelta
 from typing import List, Dict, Any
-import json
-import hashlib
+import threading
 import re
 
+from clustering import get_clustering_backend
+from metrics import StageTimer
+from sentiments import sentiment_key
+
+# Weights for combining text and temporal similarity between notes
+TEXT_WEIGHT = 0.7
+TEMPORAL_WEIGHT = 0.3
+TEMPORAL_DECAY_SECONDS = 24 * 3600 * 7  # 1 week decay
+
+_EPOCH = datetime(1970, 1, 1)
+
+def epoch_seconds(timestamps: List[datetime]) -> np.ndarray:
+    """Seconds since the epoch for naive UTC timestamps, as float64"""
+    return np.array([(ts - _EPOCH).total_seconds() for ts in timestamps], dtype=np.float64)
+
+# TextBlob loads its sentiment lexicon lazily on first use; load it once under a lock
+_lexicon_lock = threading.Lock()
+
 class MomentAnalyzer:
-    def __init__(self):
-        self.vectorizer = TfidfVectorizer(
+    """Stateless analysis pipeline - fitted vectorizers live only within a call,
+    so one instance can be shared by concurrent requests"""
+    
+    def __init__(self, similarity_dtype=np.float64, clustering_backend='auto', window_size: int = 1000):
+        # float32 halves the memory of the n x n similarity matrices
+        self.similarity_dtype = similarity_dtype
+        self.clustering_backend = get_clustering_backend(clustering_backend, window_size)
+        # TextBlob's default analyzer, shared instead of building a TextBlob per note
+        self.sentiment_analyzer = PatternAnalyzer()
+        with _lexicon_lock:
+            self.sentiment_analyzer.analyze("warm up")
+    
+    def build_vectorizer(self) -> TfidfVectorizer:
+        """Create an unfitted TF-IDF vectorizer with the analysis settings"""
+        return TfidfVectorizer(
             max_features=1000,
             stop_words='english',
             ngram_range=(1, 2),
@@ -24,14 +55,24 @@ class MomentAnalyzer:
         text = re.sub(r'\s+', ' ', text).strip()
         return text
     
+    def note_text(self, note: Dict[str, Any]) -> str:
+        """Preprocessed title and content of a note"""
+        return self.preprocess_text(f"{note['title']} {note['content']}")
+    
+    def vectorize(self, texts: List[str]):
+        """Fit a fresh vectorizer on texts and return it with the TF-IDF matrix"""
+        vectorizer = self.build_vectorizer()
+        tfidf_matrix = vectorizer.fit_transform(texts)
+        return vectorizer, tfidf_matrix
+    
     def extract_keywords(self, texts: List[str], top_k: int = 8) -> List[str]:
         """Extract key themes from clustered texts"""
         combined_text = ' '.join(texts)
         
         # Use TF-IDF to find important terms
         try:
-            tfidf_matrix = self.vectorizer.fit_transform([combined_text])
-            feature_names = self.vectorizer.get_feature_names_out()
+            vectorizer, tfidf_matrix = self.vectorize([combined_text])
+            feature_names = vectorizer.get_feature_names_out()
             tfidf_scores = tfidf_matrix.toarray()[0]
             
             # Get top keywords
@@ -49,14 +90,31 @@ class MomentAnalyzer:
             
             return sorted(word_freq.keys(), key=word_freq.get, reverse=True)[:top_k]
     
-    def analyze_sentiment(self, texts: List[str]) -> tuple:
-        """Analyze emotional tone of texts"""
-        sentiments = []
+    def score_sentiments(self, texts: List[str]) -> List[float]:
+        """Polarity of many texts in one pass, scoring each distinct text once"""
+        scores = {}
         for text in texts:
-            blob = TextBlob(text)
-            sentiments.append(blob.sentiment.polarity)
+            if text not in scores:
+                scores[text] = self.sentiment_analyzer.analyze(text).polarity
+        return [scores[text] for text in texts]
+    
+    def fill_polarities(self, notes: List[Dict[str, Any]]) -> Dict[str, float]:
+        """Score notes without a stored polarity; returns the new scores by content hash"""
+        missing = [note for note in notes if note.get('polarity') is None]
+        texts = [f"{note['title']} {note['content']}" for note in missing]
         
-        avg_sentiment = np.mean(sentiments)
+        new_scores = {}
+        for note, text, polarity in zip(missing, texts, self.score_sentiments(texts)):
+            note['polarity'] = polarity
+            new_scores[sentiment_key(text)] = polarity
+        return new_scores
+    
+    def analyze_sentiment(self, texts: List[str], polarities: List[float] = None) -> tuple:
+        """Analyze emotional tone of texts, reusing precomputed polarities if given"""
+        if polarities is None:
+            polarities = self.score_sentiments(texts)
+        
+        avg_sentiment = np.mean(polarities)
         
         if avg_sentiment > 0.1:
             tone = "Positive"
@@ -108,50 +166,75 @@ class MomentAnalyzer:
             return [[i] for i in range(len(notes))]
         
         # Prepare text data
-        texts = []
-        timestamps = []
-        for note in notes:
-            combined_text = f"{note['title']} {note['content']}"
-            texts.append(self.preprocess_text(combined_text))
-            timestamps.append(note['created_at'])
+        texts = [self.note_text(note) for note in notes]
+        timestamps = [note['created_at'] for note in notes]
         
         # Create text embeddings
         try:
-            tfidf_matrix = self.vectorizer.fit_transform(texts)
-            text_similarity = cosine_similarity(tfidf_matrix)
+            _, tfidf_matrix = self.vectorize(texts)
         except:
             # Fallback if TF-IDF fails
             return [[i] for i in range(len(notes))]
         
-        # Create temporal similarity matrix
-        temporal_similarity = np.zeros((len(notes), len(notes)))
-        for i in range(len(notes)):
-            for j in range(len(notes)):
-                if i != j:
-                    time_diff = abs((timestamps[i] - timestamps[j]).total_seconds())
-                    # Decay function: closer in time = higher similarity
-                    temporal_sim = np.exp(-time_diff / (24 * 3600 * 7))  # 1 week decay
-                    temporal_similarity[i][j] = temporal_sim
+        return self.cluster_matrix(tfidf_matrix, timestamps, min_cluster_size)
+    
+    def cluster_matrix(self, tfidf_matrix, timestamps: List[datetime], min_cluster_size: int = 2,
+                       timer: StageTimer = None) -> List[List[int]]:
+        """Cluster rows of a TF-IDF matrix combined with their timestamps"""
+        n_notes = len(timestamps)
+        if n_notes < 2:
+            return [[i] for i in range(n_notes)]
+        
+        timer = timer or StageTimer()
+        with timer.stage('cluster'):
+            cluster_labels = self.clustering_backend.cluster_labels(self, tfidf_matrix, timestamps, timer)
+            return self.group_clusters(cluster_labels, min_cluster_size)
+    
+    def distance_matrix(self, tfidf_matrix, timestamps: List[datetime], timer: StageTimer = None) -> np.ndarray:
+        """Dense combined text/temporal distance between every pair of notes"""
+        timer = timer or StageTimer()
+        text_similarity = cosine_similarity(tfidf_matrix).astype(self.similarity_dtype, copy=False)
+        with timer.stage('temporal'):
+            temporal_similarity = self.temporal_similarity(timestamps, dtype=self.similarity_dtype)
         
         # Combine similarities (70% text, 30% temporal)
-        combined_similarity = 0.7 * text_similarity + 0.3 * temporal_similarity
+        combined_similarity = TEXT_WEIGHT * text_similarity + TEMPORAL_WEIGHT * temporal_similarity
         
         # Convert similarity to distance
-        distance_matrix = 1 - combined_similarity
+        return 1 - combined_similarity
+    
+    def agglomerative_labels(self, distance_matrix: np.ndarray):
+        """Average-linkage cluster labels for a precomputed distance matrix"""
+        n_notes = distance_matrix.shape[0]
         
         # Simple clustering using Agglomerative
         try:
-            n_clusters = max(1, len(notes) // 3)
+            n_clusters = max(1, n_notes // 3)
             clusterer = AgglomerativeClustering(
                 n_clusters=n_clusters,
                 metric='precomputed',
                 linkage='average'
             )
-            cluster_labels = clusterer.fit_predict(distance_matrix)
+            return clusterer.fit_predict(distance_matrix)
         except:
             # Fallback: each note is its own cluster
-            cluster_labels = list(range(len(notes)))
+            return list(range(n_notes))
+    
+    def temporal_similarity(self, timestamps: List[datetime], dtype=np.float64) -> np.ndarray:
+        """Pairwise exponential time-decay similarity, zero on the diagonal"""
+        # Shift and scale in float64 first so float32 keeps sub-minute precision
+        seconds = epoch_seconds(timestamps)
+        scaled = ((seconds - seconds.min()) / TEMPORAL_DECAY_SECONDS).astype(dtype)
         
+        # Decay function: closer in time = higher similarity
+        similarity = np.abs(scaled[:, None] - scaled[None, :])
+        np.negative(similarity, out=similarity)
+        np.exp(similarity, out=similarity)
+        np.fill_diagonal(similarity, 0)
+        return similarity
+    
+    def group_clusters(self, cluster_labels, min_cluster_size: int = 2) -> List[List[int]]:
+        """Group note indices by label, splitting small clusters into single notes"""
         # Group notes by cluster
         clusters = {}
         for i, label in enumerate(cluster_labels):
@@ -170,64 +253,107 @@ class MomentAnalyzer:
         for cluster in valid_clusters:
             clustered_indices.update(cluster)
         
-        for i in range(len(notes)):
+        for i in range(len(cluster_labels)):
             if i not in clustered_indices:
                 valid_clusters.append([i])
         
         return valid_clusters
     
-    def analyze_notes(self, notes: List[Dict[str, Any]], min_cluster_size: int = 2) -> List[Dict[str, Any]]:
-        """Main analysis pipeline"""
+    def cluster_keywords(self, tfidf_matrix, feature_names, clusters: List[List[int]], top_k: int = 8) -> List[List[str]]:
+        """Distinctive terms per cluster from the corpus TF-IDF matrix in one sparse product"""
+        # Row i of the indicator matrix averages the TF-IDF rows of cluster i
+        rows = np.repeat(np.arange(len(clusters)), [len(indices) for indices in clusters])
+        cols = np.concatenate([np.asarray(indices, dtype=np.int64) for indices in clusters])
+        weights = np.repeat([1.0 / len(indices) for indices in clusters], [len(indices) for indices in clusters])
+        membership = sp.csr_matrix((weights, (rows, cols)), shape=(len(clusters), tfidf_matrix.shape[0]))
+        cluster_scores = (membership @ tfidf_matrix).tocsr()
+        
+        keywords = []
+        for i in range(len(clusters)):
+            start, end = cluster_scores.indptr[i], cluster_scores.indptr[i + 1]
+            scores = cluster_scores.data[start:end]
+            terms = cluster_scores.indices[start:end]
+            # Highest score first; ties broken by term order for stable output
+            top = np.lexsort((terms, -scores))[:top_k]
+            keywords.append([feature_names[terms[j]] for j in top if scores[j] > 0])
+        return keywords
+    
+    def build_moment(self, cluster_notes: List[Dict[str, Any]], keywords: List[str] = None) -> Dict[str, Any]:
+        """Turn one cluster of date-ordered notes into a moment"""
+        # Extract text content
+        texts = [f"{note['title']} {note['content']}" for note in cluster_notes]
+        dates = [note['created_at'] for note in cluster_notes]
+        polarities = [note.get('polarity') for note in cluster_notes]
+        
+        # Analyze cluster
+        if keywords is None:
+            keywords = self.extract_keywords(texts)
+        tone, sentiment_score = self.analyze_sentiment(
+            texts, None if None in polarities else polarities
+        )
+        title = self.create_moment_title(keywords, dates)
+        reflection_prompt = self.generate_reflection_prompt(keywords, tone)
+        
+        # Create summary
+        summary = f"A collection of {len(cluster_notes)} thoughts and experiences "
+        if keywords:
+            summary += f"centered around {', '.join(keywords[:3])}. "
+        summary += f"This period shows a {tone.lower()} emotional tone with themes of personal reflection and growth."
+        
+        return {
+            'title': title,
+            'summary': summary,
+            'emotional_tone': tone,
+            'emotional_score': sentiment_score,
+            'keywords': keywords,
+            'reflection_prompt': reflection_prompt,
+            'start_date': min(dates),
+            'end_date': max(dates),
+            'note_count': len(cluster_notes),
+            'note_ids': [note['id'] for note in cluster_notes]
+        }
+    
+    def analyze_notes(self, notes: List[Dict[str, Any]], min_cluster_size: int = 2,
+                      timer: StageTimer = None) -> List[Dict[str, Any]]:
+        """Main analysis pipeline; pass a StageTimer to get seconds spent per stage"""
         if not notes:
             return []
         
+        timer = timer or StageTimer()
+        
         # Sort notes by date
-        notes_sorted = sorted(notes, key=lambda x: x['created_at'])
+        with timer.stage('preprocess'):
+            notes_sorted = sorted(notes, key=lambda x: x['created_at'])
+            texts = [self.note_text(note) for note in notes_sorted]
+            timestamps = [note['created_at'] for note in notes_sorted]
         
-        # Cluster notes
-        clusters = self.cluster_notes(notes_sorted, min_cluster_size)
+        # One TF-IDF fit serves both clustering and keyword extraction
+        try:
+            with timer.stage('vectorize'):
+                vectorizer, tfidf_matrix = self.vectorize(texts)
+        except ValueError:
+            # Empty vocabulary: every note stands alone, keywords by word frequency
+            clusters = [[i] for i in range(len(notes_sorted))]
+            keywords = [None] * len(clusters)
+        else:
+            clusters = self.cluster_matrix(tfidf_matrix, timestamps, min_cluster_size, timer)
+            with timer.stage('keywords'):
+                keywords = self.cluster_keywords(tfidf_matrix, vectorizer.get_feature_names_out(), clusters)
         
-        moments = []
-        for cluster_indices in clusters:
-            cluster_notes = [notes_sorted[i] for i in cluster_indices]
-            
-            # Extract text content
-            texts = [f"{note['title']} {note['content']}" for note in cluster_notes]
-            dates = [note['created_at'] for note in cluster_notes]
-            
-            # Analyze cluster
-            keywords = self.extract_keywords(texts)
-            tone, sentiment_score = self.analyze_sentiment(texts)
-            title = self.create_moment_title(keywords, dates)
-            reflection_prompt = self.generate_reflection_prompt(keywords, tone)
-            
-            # Create summary
-            summary = f"A collection of {len(cluster_notes)} thoughts and experiences "
-            if keywords:
-                summary += f"centered around {', '.join(keywords[:3])}. "
-            summary += f"This period shows a {tone.lower()} emotional tone with themes of personal reflection and growth."
-            
-            moment = {
-                'title': title,
-                'summary': summary,
-                'emotional_tone': tone,
-                'emotional_score': sentiment_score,
-                'keywords': keywords,
-                'reflection_prompt': reflection_prompt,
-                'start_date': min(dates),
-                'end_date': max(dates),
-                'note_count': len(cluster_notes),
-                'note_ids': [notes_sorted[i]['id'] for i in cluster_indices]
-            }
-            
-            moments.append(moment)
+        # Score every note up front so moment generation only averages polarities
+        with timer.stage('sentiment'):
+            self.fill_polarities(notes_sorted)
+        
+        with timer.stage('moments'):
+            cluster_notes_list = [[notes_sorted[i] for i in cluster_indices] for cluster_indices in clusters]
+            moments = self.build_moments(cluster_notes_list, keywords)
         
         # Sort moments by start date
         moments.sort(key=lambda x: x['start_date'])
         
         return moments
     
-    def hash_notes(self, notes: List[Dict[str, Any]]) -> str:
-        """Create hash of notes for caching"""
-        notes_str = json.dumps(notes, sort_keys=True, default=str)
-        return hashlib.md5(notes_str.encode()).hexdigest()
\ No newline at end of file
+    def build_moments(self, clusters: List[List[Dict[str, Any]]], keywords: List[List[str]] = None) -> List[Dict[str, Any]]:
+        """Build moments for many clusters, in cluster order"""
+        keywords = keywords or [None] * len(clusters)
+        return [self.build_moment(cluster_notes, cluster_keywords) for cluster_notes, cluster_keywords in zip(clusters, keywords)]
@@ -4,8 +4,11 @@ from jose import JWTError, jwt
 import hashlib
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
-from database import get_db
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from database import get_async_db
+from user_cache import CachedUser, user_cache
 import models
 import os
 
@@ -51,11 +54,24 @@ def verify_token(credentials: HTTPAuthorizationCredentials = Depends(security)):
             headers={"WWW-Authenticate": "Bearer"},
         )
 
-def get_current_user(email: str = Depends(verify_token), db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == email).first()
+async def get_current_user(email: str = Depends(verify_token), db: AsyncSession = Depends(get_async_db)) -> CachedUser:
+    if user_cache.blocking:
+        cached = await run_in_threadpool(user_cache.get, email)
+    else:
+        cached = user_cache.get(email)
+    if cached is not None:
+        return cached
+    
+    user = await db.scalar(select(models.User).where(models.User.email == email))
     if user is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="User not found"
         )
-    return user
\ No newline at end of file
+    
+    cached = CachedUser.from_model(user)
+    if user_cache.blocking:
+        await run_in_threadpool(user_cache.set, cached)
+    else:
+        user_cache.set(cached)
+    return cached
\ No newline at end of file
@@ -0,0 +1,501 @@
+"""
+Benchmarks for the EchoTrail analysis pipeline
+
+Usage:
+    python benchmark.py analysis [--sizes 100 1000 10000 50000] [--output results.json] [--baseline previous.json]
+    python benchmark.py temporal [--sizes 100 1000 10000] [--output results.json]
+    python benchmark.py demo [--repeat 50] [--output results.json]
+    python benchmark.py load [--profiles default wal] [--threads 8] [--duration 10] [--output results.json]
+    python benchmark.py startup [--modes eager background off] [--repeat 5] [--output results.json]
+"""
+from datetime import datetime, timedelta
+from typing import List, Dict, Any
+import argparse
+import json
+import os
+import platform
+import random
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+import urllib.request
+
+import numpy as np
+import sklearn
+
+from sqlalchemy import create_engine
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.orm import sessionmaker
+
+import models
+from analyzer import MomentAnalyzer, TEMPORAL_DECAY_SECONDS
+from bulk import insert_demo_dataset, insert_moments, insert_notes
+from database import create_database_engine
+from pagination import keyset_page
+from search import create_search_index
+from demo_data import DemoDataSeeder
+from demo_template import DemoTemplate
+from images import store_images
+from judge_demo import JudgeDemoData
+from metrics import StageTimer
+from rollups import apply_note_deltas, note_as_dict
+
+def random_timestamps(count: int, days: int = 365, seed: int = 42) -> List[datetime]:
+    """Sorted timestamps spread over the given number of days"""
+    rng = random.Random(seed)
+    start = datetime(2024, 1, 1)
+    return sorted(start + timedelta(seconds=rng.uniform(0, days * 24 * 3600)) for _ in range(count))
+
+def synthetic_notes(count: int, seed: int = 42) -> List[Dict[str, Any]]:
+    """A note history of any size built from the demo and judge datasets
+
+    Titles and contents are recombined across templates so larger histories
+    do not collapse into exact duplicates, and notes arrive a few per day.
+    """
+    rng = random.Random(seed)
+    templates = DemoDataSeeder().sample_notes + JudgeDemoData.get_demo_notes()
+    start = datetime(2020, 1, 1)
+
+    notes = []
+    elapsed = 0.0
+    for i in range(count):
+        title_source = rng.choice(templates)
+        content_source = rng.choice(templates)
+        elapsed += rng.expovariate(3 / (24 * 3600))  # about three notes a day
+        created_at = start + timedelta(seconds=elapsed)
+        notes.append({
+            'id': i + 1,
+            'title': title_source['title'],
+            'content': f"{content_source['content']} {rng.choice(templates)['title']}",
+            'mood': content_source['mood'],
+            'energy_level': content_source['energy_level'],
+            'created_at': created_at,
+            'updated_at': created_at
+        })
+    return notes
+
+def temporal_similarity_loop(timestamps: List[datetime]) -> np.ndarray:
+    """Reference pairwise loop the vectorized temporal similarity replaced"""
+    n_notes = len(timestamps)
+    similarity = np.zeros((n_notes, n_notes))
+    for i in range(n_notes):
+        for j in range(n_notes):
+            if i != j:
+                time_diff = abs((timestamps[i] - timestamps[j]).total_seconds())
+                similarity[i][j] = np.exp(-time_diff / TEMPORAL_DECAY_SECONDS)
+    return similarity
+
+def _timed(func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    return result, time.perf_counter() - start
+
+def bench_temporal(sizes: List[int], loop_max: int) -> List[Dict[str, Any]]:
+    """Time the temporal similarity matrix against the pairwise loop"""
+    analyzer = MomentAnalyzer()
+    results = []
+    for size in sizes:
+        timestamps = random_timestamps(size)
+        vectorized, vectorized_time = _timed(analyzer.temporal_similarity, timestamps)
+        vectorized32, vectorized32_time = _timed(analyzer.temporal_similarity, timestamps, dtype=np.float32)
+
+        row = {
+            "notes": size,
+            "vectorized_float64_s": round(vectorized_time, 6),
+            "vectorized_float32_s": round(vectorized32_time, 6),
+            "matrix_mb_float64": round(vectorized.nbytes / 1e6, 1),
+            "matrix_mb_float32": round(vectorized32.nbytes / 1e6, 1),
+            "max_abs_error_float32": float(np.abs(vectorized32 - vectorized).max()),
+        }
+        if size <= loop_max:
+            reference, loop_time = _timed(temporal_similarity_loop, timestamps)
+            row["loop_s"] = round(loop_time, 6)
+            row["speedup"] = round(loop_time / vectorized_time, 1)
+            row["max_abs_error_float64"] = float(np.abs(reference - vectorized).max())
+        results.append(row)
+        print(json.dumps(row))
+        del vectorized, vectorized32
+    return results
+
+def run_stages(analyzer: MomentAnalyzer, notes: List[Dict[str, Any]]) -> Dict[str, float]:
+    """Run analyze_notes, returning seconds spent per stage from its timing hooks"""
+    timer = StageTimer()
+    moments = analyzer.analyze_notes(notes, timer=timer)
+
+    stages = {name: round(seconds, 6) for name, seconds in timer.timings.items()}
+    stages["total"] = round(sum(timer.timings.values()), 6)
+    stages["clusters"] = len(moments)
+    return stages
+
+def bench_analysis(sizes: List[int], backend: str, window_size: int, track_memory: bool) -> List[Dict[str, Any]]:
+    """Time each stage of the analysis pipeline and record peak traced memory"""
+    results = []
+    for size in sizes:
+        notes = synthetic_notes(size)
+        analyzer = MomentAnalyzer(clustering_backend=backend, window_size=window_size)
+
+        row = {"notes": size, "stages": run_stages(analyzer, notes)}
+        if track_memory:
+            # Separate pass: tracing allocations slows the pure-Python stages considerably
+            tracemalloc.start()
+            run_stages(analyzer, synthetic_notes(size))
+            row["peak_memory_mb"] = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+            tracemalloc.stop()
+
+        results.append(row)
+        print(json.dumps(row))
+    return results
+
+def find_regressions(results: List[Dict[str, Any]], baseline: Dict[str, Any], tolerance: float) -> List[str]:
+    """Stages that got slower than the baseline by more than the tolerance"""
+    previous = {row["notes"]: row for row in baseline.get("results", [])}
+    regressions = []
+    for row in results:
+        before = previous.get(row["notes"])
+        if before is None:
+            continue
+        for name, seconds in row["stages"].items():
+            old = before["stages"].get(name)
+            # Ignore stages too fast to time reliably
+            if name == "clusters" or not old or max(old, seconds) < 0.05:
+                continue
+            if seconds > old * (1 + tolerance):
+                regressions.append(f"{row['notes']} notes / {name}: {old:.3f}s -> {seconds:.3f}s")
+        if "peak_memory_mb" in row and before.get("peak_memory_mb"):
+            if row["peak_memory_mb"] > before["peak_memory_mb"] * (1 + tolerance):
+                regressions.append(
+                    f"{row['notes']} notes / memory: {before['peak_memory_mb']}MB -> {row['peak_memory_mb']}MB"
+                )
+    return regressions
+
+def legacy_demo_load(db, user_id: int, notes: List[Dict[str, Any]], precomputed_moments: List[Dict[str, Any]]):
+    """The row-by-row ORM writes the demo endpoints used before the bulk path
+
+    Images and rollups are written as the bulk path writes them, so only
+    the insert pattern differs.
+    """
+    added = []
+    for note_data in notes:
+        image_hash = store_images(db, [note_data.get("image_data")])[0]
+        note = models.Note(
+            title=note_data["title"],
+            content=note_data["content"],
+            mood=note_data["mood"],
+            energy_level=note_data["energy_level"],
+            image_hash=image_hash,
+            created_at=note_data["created_at"],
+            updated_at=note_data["created_at"],
+            user_id=user_id
+        )
+        db.add(note)
+        added.append(note)
+    db.flush()
+    apply_note_deltas(db, user_id, [note_as_dict(note) for note in added])
+    db.commit()
+    for moment_data in precomputed_moments:
+        db.add(models.Moment(
+            title=moment_data['title'],
+            summary=moment_data['summary'],
+            emotional_tone=moment_data['emotional_tone'],
+            emotional_score=moment_data['emotional_score'],
+            keywords=json.dumps(moment_data['keywords']),
+            reflection_prompt=moment_data['reflection_prompt'],
+            start_date=datetime.fromisoformat(moment_data['start_date']),
+            end_date=datetime.fromisoformat(moment_data['end_date']),
+            note_count=moment_data['note_count'],
+            note_ids=json.dumps(moment_data['note_ids']),
+            user_id=user_id
+        ))
+    db.commit()
+
+def legacy_save_moments(db, user_id: int, moments: List[Dict[str, Any]]):
+    for moment_data in moments:
+        db.add(models.Moment(
+            title=moment_data['title'],
+            summary=moment_data['summary'],
+            emotional_tone=moment_data['emotional_tone'],
+            emotional_score=moment_data['emotional_score'],
+            keywords=json.dumps(moment_data['keywords']),
+            reflection_prompt=moment_data['reflection_prompt'],
+            start_date=moment_data['start_date'],
+            end_date=moment_data['end_date'],
+            note_count=moment_data['note_count'],
+            note_ids=json.dumps(moment_data['note_ids']),
+            user_id=user_id
+        ))
+    db.commit()
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    samples = sorted(samples)
+    return {
+        "mean_ms": round(statistics.mean(samples) * 1000, 3),
+        "p50_ms": round(samples[len(samples) // 2] * 1000, 3),
+        "p95_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 3),
+    }
+
+def bench_demo(repeat: int) -> List[Dict[str, Any]]:
+    """Time demo seeding and moment persistence against the approach each replaced"""
+    notes = JudgeDemoData.get_demo_notes()
+    precomputed = JudgeDemoData.get_precomputed_moments()
+    template = DemoTemplate(notes, precomputed)
+    seeded = DemoDataSeeder().generate_demo_notes(0)
+    moments = MomentAnalyzer().analyze_notes(synthetic_notes(1000))
+
+    scenarios = {
+        "public_demo": (
+            lambda db, user_id: legacy_demo_load(db, user_id, notes, precomputed),
+            lambda db, user_id: insert_demo_dataset(db, user_id, notes, precomputed)
+        ),
+        # Rebuilding the dataset per visitor vs copying the prebuilt template
+        "demo_template": (
+            lambda db, user_id: insert_demo_dataset(
+                db, user_id, JudgeDemoData.get_demo_notes(), JudgeDemoData.get_precomputed_moments()
+            ),
+            lambda db, user_id: template.provision(db, user_id)
+        ),
+        "seed_demo": (
+            lambda db, user_id: legacy_demo_load(db, user_id, seeded, []),
+            lambda db, user_id: insert_demo_dataset(db, user_id, seeded)
+        ),
+        "save_moments": (
+            lambda db, user_id: legacy_save_moments(db, user_id, moments),
+            lambda db, user_id: insert_moments(db, user_id, moments)
+        ),
+    }
+
+    results = []
+    with tempfile.TemporaryDirectory() as directory:
+        engine = create_engine(f"sqlite:///{os.path.join(directory, 'bench.db')}")
+        models.Base.metadata.create_all(bind=engine)
+        Session = sessionmaker(bind=engine)
+
+        for name, (legacy, bulk) in scenarios.items():
+            row = {"scenario": name}
+            for label, write in (("legacy", legacy), ("bulk", bulk)):
+                samples = []
+                for i in range(repeat):
+                    db = Session()
+                    try:
+                        user = models.User(email=f"{name}-{label}-{i}@bench.local", hashed_password="x")
+                        db.add(user)
+                        db.commit()
+                        _, elapsed = _timed(write, db, user.id)
+                        samples.append(elapsed)
+                    finally:
+                        db.close()
+                row[label] = _summary(samples)
+            row["speedup"] = round(row["legacy"]["mean_ms"] / row["bulk"]["mean_ms"], 1)
+            results.append(row)
+            print(json.dumps(row))
+        engine.dispose()
+    return results
+
+def bench_load(profiles: List[str], threads: int, duration: float, write_ratio: float) -> List[Dict[str, Any]]:
+    """Mixed concurrent note writes and page reads against each engine profile"""
+    results = []
+    for profile in profiles:
+        with tempfile.TemporaryDirectory() as directory:
+            engine = create_database_engine(f"sqlite:///{os.path.join(directory, 'load.db')}", profile)
+            models.Base.metadata.create_all(bind=engine)
+            create_search_index(engine)
+            Session = sessionmaker(bind=engine)
+
+            db = Session()
+            user = models.User(email="load@bench.local", hashed_password="x")
+            db.add(user)
+            db.commit()
+            user_id = user.id
+            insert_notes(db, user_id, synthetic_notes(5000))
+            db.close()
+
+            counts = {"reads": 0, "writes": 0, "errors": 0}
+            latencies = {"reads": [], "writes": []}
+            lock = threading.Lock()
+            deadline = time.perf_counter() + duration
+
+            def worker(seed: int):
+                rng = random.Random(seed)
+                while time.perf_counter() < deadline:
+                    kind = "writes" if rng.random() < write_ratio else "reads"
+                    db = Session()
+                    start = time.perf_counter()
+                    try:
+                        if kind == "writes":
+                            db.add(models.Note(title="load test", content="a note written under load",
+                                               mood="😐", energy_level=3, user_id=user_id))
+                            db.commit()
+                        else:
+                            keyset_page(db.query(models.Note).filter(models.Note.user_id == user_id),
+                                        models.Note.created_at, models.Note.id, 50)
+                        elapsed = time.perf_counter() - start
+                        with lock:
+                            counts[kind] += 1
+                            latencies[kind].append(elapsed)
+                    except OperationalError:
+                        with lock:
+                            counts["errors"] += 1
+                    finally:
+                        db.close()
+
+            workers = [threading.Thread(target=worker, args=(i,)) for i in range(threads)]
+            for thread in workers:
+                thread.start()
+            for thread in workers:
+                thread.join()
+            engine.dispose()
+
+        row = {
+            "profile": profile,
+            "threads": threads,
+            "reads_per_s": round(counts["reads"] / duration, 1),
+            "writes_per_s": round(counts["writes"] / duration, 1),
+            "errors": counts["errors"],
+        }
+        for kind in ("reads", "writes"):
+            if latencies[kind]:
+                row[kind] = _summary(latencies[kind])
+        results.append(row)
+        print(json.dumps(row))
+    return results
+
+def _request(url: str, body: Dict[str, Any] = None, token: str = None) -> Dict[str, Any]:
+    headers = {"Content-Type": "application/json"}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    data = json.dumps(body).encode() if body is not None else None
+    with urllib.request.urlopen(urllib.request.Request(url, data=data, headers=headers), timeout=60) as response:
+        return json.loads(response.read())
+
+def bench_startup(modes: List[str], repeat: int) -> List[Dict[str, Any]]:
+    """Time from launching the API to its first /health answer, and its first analysis, per ANALYZER_WARMUP mode"""
+    results = []
+    for mode in modes:
+        health, first_analysis = [], []
+        for _ in range(repeat):
+            with tempfile.TemporaryDirectory() as directory, socket.socket() as probe:
+                probe.bind(("127.0.0.1", 0))
+                port = probe.getsockname()[1]
+                probe.close()
+                env = dict(
+                    os.environ,
+                    DATABASE_URL=f"sqlite:///{os.path.join(directory, 'startup.db')}",
+                    ANALYZER_WARMUP=mode,
+                    REAPER_INTERVAL_SECONDS="0"
+                )
+                base_url = f"http://127.0.0.1:{port}"
+                start = time.perf_counter()
+                server = subprocess.Popen(
+                    [sys.executable, "-m", "uvicorn", "main:app", "--port", str(port), "--log-level", "warning"],
+                    cwd=os.path.dirname(os.path.abspath(__file__)), env=env,
+                    stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL
+                )
+                try:
+                    while True:
+                        try:
+                            _request(f"{base_url}/health")
+                            break
+                        except OSError:
+                            if server.poll() is not None:
+                                raise RuntimeError(f"API exited during startup with code {server.returncode}")
+                            time.sleep(0.01)
+                    health.append(time.perf_counter() - start)
+
+                    token = _request(f"{base_url}/demo/public", {})["access_token"]
+                    analysis_start = time.perf_counter()
+                    _request(f"{base_url}/analyze", {"incremental": False}, token)
+                    first_analysis.append(time.perf_counter() - analysis_start)
+                finally:
+                    server.terminate()
+                    server.wait(timeout=30)
+
+        row = {"warmup": mode, "first_health": _summary(health), "first_analysis": _summary(first_analysis)}
+        results.append(row)
+        print(json.dumps(row))
+    return results
+
+def environment() -> Dict[str, Any]:
+    return {
+        "created_at": datetime.utcnow().isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "scikit_learn": sklearn.__version__,
+        "machine": platform.machine(),
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    analysis = subparsers.add_parser("analysis", help="per-stage timings and peak memory of analyze_notes")
+    analysis.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+    analysis.add_argument("--backend", default="auto", help="clustering backend (dense, windowed, auto)")
+    analysis.add_argument("--window-size", type=int, default=1000)
+    analysis.add_argument("--no-memory", action="store_true", help="skip the extra tracemalloc pass for peak memory")
+    analysis.add_argument("--baseline", help="earlier results JSON to compare against")
+    analysis.add_argument("--tolerance", type=float, default=0.25, help="allowed slowdown before flagging a regression")
+    analysis.add_argument("--output", help="write results as JSON to this file")
+
+    temporal = subparsers.add_parser("temporal", help="temporal similarity matrix, loop vs vectorized")
+    temporal.add_argument("--sizes", type=int, nargs="+", default=[100, 500, 1000, 2000, 5000, 10000])
+    temporal.add_argument("--loop-max", type=int, default=2000, help="largest size to run the slow loop for")
+    temporal.add_argument("--output", help="write results as JSON to this file")
+
+    demo = subparsers.add_parser("demo", help="demo seeding and moment persistence, row-by-row vs bulk inserts")
+    demo.add_argument("--repeat", type=int, default=50)
+    demo.add_argument("--output", help="write results as JSON to this file")
+
+    load = subparsers.add_parser("load", help="concurrent read/write throughput per database engine profile")
+    load.add_argument("--profiles", nargs="+", default=["default", "wal"])
+    load.add_argument("--threads", type=int, default=8)
+    load.add_argument("--duration", type=float, default=10.0, help="seconds per profile")
+    load.add_argument("--write-ratio", type=float, default=0.3)
+    load.add_argument("--output", help="write results as JSON to this file")
+
+    startup = subparsers.add_parser("startup", help="API cold start: time to first /health and first analysis")
+    startup.add_argument("--modes", nargs="+", default=["eager", "background", "off"],
+                         help="ANALYZER_WARMUP modes; eager loads everything before serving, like before")
+    startup.add_argument("--repeat", type=int, default=5)
+    startup.add_argument("--output", help="write results as JSON to this file")
+
+    args = parser.parse_args()
+
+    regressions = []
+    if args.command == "analysis":
+        results = {
+            "benchmark": "analysis",
+            "backend": args.backend,
+            "window_size": args.window_size,
+            "environment": environment(),
+            "results": bench_analysis(args.sizes, args.backend, args.window_size, not args.no_memory)
+        }
+        if args.baseline:
+            with open(args.baseline) as f:
+                regressions = find_regressions(results["results"], json.load(f), args.tolerance)
+            results["regressions"] = regressions
+    elif args.command == "temporal":
+        results = {"benchmark": "temporal", "environment": environment(),
+                   "results": bench_temporal(args.sizes, args.loop_max)}
+    elif args.command == "demo":
+        results = {"benchmark": "demo", "environment": environment(), "results": bench_demo(args.repeat)}
+    elif args.command == "load":
+        results = {"benchmark": "load", "environment": environment(),
+                   "results": bench_load(args.profiles, args.threads, args.duration, args.write_ratio)}
+    elif args.command == "startup":
+        results = {"benchmark": "startup", "environment": environment(), "results": bench_startup(args.modes, args.repeat)}
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+    for regression in regressions:
+        print(f"REGRESSION {regression}")
+    if regressions:
+        sys.exit(1)
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+"""
+Bulk writes - executemany-style inserts shared by note imports, demo seeding
+and moment persistence
+"""
+from datetime import datetime
+from typing import List, Dict, Any, Tuple
+import json
+import os
+
+from sqlalchemy import insert
+from sqlalchemy.orm import Session
+
+import models
+from rollups import apply_note_deltas, clear_rollups
+from images import store_images, delete_unreferenced_images
+
+# Notes written per transaction during bulk imports
+BULK_CHUNK_SIZE = int(os.getenv("BULK_CHUNK_SIZE", "1000"))
+BULK_IMPORT_MAX_NOTES = int(os.getenv("BULK_IMPORT_MAX_NOTES", "50000"))
+
+def note_row(user_id: int, note: Dict[str, Any], image_hash: str = None, now: datetime = None) -> Dict[str, Any]:
+    """Column values for one note, stamped now unless it brings its own date"""
+    created_at = note.get('created_at') or now or datetime.utcnow()
+    return {
+        'title': note['title'],
+        'content': note['content'],
+        'mood': note.get('mood'),
+        'energy_level': note.get('energy_level'),
+        'image_hash': image_hash,
+        'created_at': created_at,
+        'updated_at': created_at,
+        'user_id': user_id
+    }
+
+def insert_notes(db: Session, user_id: int, notes: List[Dict[str, Any]], commit: bool = True) -> List[int]:
+    """Insert notes in one executemany statement and return their ids in order"""
+    if not notes:
+        return []
+
+    now = datetime.utcnow()
+    image_hashes = store_images(db, [note.get('image_data') for note in notes])
+    rows = [note_row(user_id, note, image_hash, now) for note, image_hash in zip(notes, image_hashes)]
+    result = db.execute(insert(models.Note).returning(
+        models.Note.id, models.Note.created_at, models.Note.mood, models.Note.energy_level,
+        sort_by_parameter_order=True
+    ), rows)
+    # Roll up the values as stored, column defaults included
+    inserted = [row._asdict() for row in result]
+    apply_note_deltas(db, user_id, inserted)
+    ids = [row['id'] for row in inserted]
+    if commit:
+        db.commit()
+    return ids
+
+def moment_row(user_id: int, moment: Dict[str, Any]) -> Dict[str, Any]:
+    """Column values for one analyzed moment"""
+    return {
+        'title': moment['title'],
+        'summary': moment['summary'],
+        'emotional_tone': moment['emotional_tone'],
+        'emotional_score': moment['emotional_score'],
+        'keywords': json.dumps(moment['keywords']),
+        'reflection_prompt': moment['reflection_prompt'],
+        'start_date': moment['start_date'],
+        'end_date': moment['end_date'],
+        'note_count': moment['note_count'],
+        'note_ids': json.dumps(moment['note_ids']),
+        'user_id': user_id
+    }
+
+def insert_moments(db: Session, user_id: int, moments: List[Dict[str, Any]], commit: bool = True):
+    """Insert moments in one executemany statement"""
+    if moments:
+        db.execute(insert(models.Moment), [moment_row(user_id, moment) for moment in moments])
+    if commit:
+        db.commit()
+
+def clear_user_data(db: Session, user_id: int):
+    """Delete a user's notes, moments, note rollups and unshared images without committing"""
+    image_hashes = [
+        content_hash for (content_hash,) in db.query(models.Note.image_hash).filter(
+            models.Note.user_id == user_id, models.Note.image_hash.isnot(None)
+        ).distinct()
+    ]
+    db.query(models.Note).filter(models.Note.user_id == user_id).delete(synchronize_session=False)
+    delete_unreferenced_images(db, image_hashes)
+    db.query(models.Moment).filter(models.Moment.user_id == user_id).delete(synchronize_session=False)
+    clear_rollups(db, user_id)
+
+def insert_demo_dataset(db: Session, user_id: int, notes: List[Dict[str, Any]],
+                        precomputed_moments: List[Dict[str, Any]] = ()) -> Tuple[int, int]:
+    """Write demo notes and their precomputed moments in a single transaction
+
+    Precomputed moments list their notes by 1-based position in the demo
+    dataset; those positions are mapped to the ids the notes were given.
+    """
+    note_ids = insert_notes(db, user_id, notes, commit=False)
+    moments = [
+        dict(
+            moment,
+            start_date=datetime.fromisoformat(moment['start_date']),
+            end_date=datetime.fromisoformat(moment['end_date']),
+            note_ids=[note_ids[position - 1] for position in moment['note_ids']]
+        )
+        for moment in precomputed_moments
+    ]
+    insert_moments(db, user_id, moments, commit=False)
+    db.commit()
+    return len(note_ids), len(moments)
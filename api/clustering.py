@@ -0,0 +1,96 @@
+"""
+Clustering backends - turn a TF-IDF matrix and note timestamps into cluster labels
+"""
+from datetime import datetime
+from typing import List
+
+from metrics import StageTimer
+
+import numpy as np
+
+class DenseClusteringBackend:
+    """Average-linkage clustering over the full n x n distance matrix - O(n^2) memory"""
+
+    name = 'dense'
+
+    def cluster_labels(self, analyzer, tfidf_matrix, timestamps: List[datetime], timer: StageTimer = None) -> np.ndarray:
+        distance_matrix = analyzer.distance_matrix(tfidf_matrix, timestamps, timer)
+        return analyzer.agglomerative_labels(distance_matrix)
+
+class WindowedClusteringBackend:
+    """Dense clustering inside consecutive time windows of at most window_size notes
+
+    Only notes that are close in time are ever compared, so memory is
+    O(window_size^2) and time grows linearly with the number of notes.
+    Windows are cut at the widest time gap near their end to avoid
+    splitting a burst of related notes.
+    """
+
+    name = 'windowed'
+
+    def __init__(self, window_size: int = 1000):
+        self.window_size = max(2, window_size)
+
+    def windows(self, seconds: np.ndarray) -> List[np.ndarray]:
+        """Split time-ordered positions into windows, cutting at the widest gap"""
+        windows = []
+        start = 0
+        n_notes = len(seconds)
+        while start < n_notes:
+            end = start + self.window_size
+            if end < n_notes:
+                # Cut somewhere in the second half of the window, at the widest gap
+                lower = start + self.window_size // 2
+                gaps = np.diff(seconds[lower - 1:end])
+                end = lower + int(np.argmax(gaps))
+            windows.append(np.arange(start, min(end, n_notes)))
+            start = end
+        return windows
+
+    def cluster_labels(self, analyzer, tfidf_matrix, timestamps: List[datetime], timer: StageTimer = None) -> np.ndarray:
+        seconds = np.array([(ts - timestamps[0]).total_seconds() for ts in timestamps])
+        order = np.argsort(seconds, kind='stable')
+
+        labels = np.empty(len(timestamps), dtype=np.int64)
+        next_label = 0
+        for window in self.windows(seconds[order]):
+            rows = order[window]
+            window_timestamps = [timestamps[i] for i in rows]
+            if len(rows) < 2:
+                window_labels = np.zeros(len(rows), dtype=np.int64)
+            else:
+                distance_matrix = analyzer.distance_matrix(tfidf_matrix[rows], window_timestamps, timer)
+                window_labels = np.asarray(analyzer.agglomerative_labels(distance_matrix))
+            labels[rows] = window_labels + next_label
+            next_label += int(window_labels.max()) + 1
+        return labels
+
+class AutoClusteringBackend:
+    """Dense clustering for small accounts, windowed once they outgrow one window"""
+
+    name = 'auto'
+
+    def __init__(self, window_size: int = 1000):
+        self.dense = DenseClusteringBackend()
+        self.windowed = WindowedClusteringBackend(window_size)
+
+    def cluster_labels(self, analyzer, tfidf_matrix, timestamps: List[datetime], timer: StageTimer = None) -> np.ndarray:
+        if len(timestamps) <= self.windowed.window_size:
+            return self.dense.cluster_labels(analyzer, tfidf_matrix, timestamps, timer)
+        return self.windowed.cluster_labels(analyzer, tfidf_matrix, timestamps, timer)
+
+CLUSTERING_BACKENDS = {
+    'dense': DenseClusteringBackend,
+    'windowed': WindowedClusteringBackend,
+    'auto': AutoClusteringBackend,
+}
+
+def get_clustering_backend(backend='auto', window_size: int = 1000):
+    """Resolve a backend name to an instance; backend objects are passed through"""
+    if not isinstance(backend, str):
+        return backend
+    if backend not in CLUSTERING_BACKENDS:
+        raise ValueError(f"Unknown clustering backend '{backend}', expected one of {sorted(CLUSTERING_BACKENDS)}")
+    if backend == 'dense':
+        return DenseClusteringBackend()
+    return CLUSTERING_BACKENDS[backend](window_size)
@@ -1,6 +1,12 @@
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event, inspect, text
+from sqlalchemy.engine import Engine, make_url
+from sqlalchemy.ext.asyncio import AsyncEngine, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker
-from models import Base
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from models import Base, DailyNoteStats
+from search import create_search_index, register_search_index
+from rollups import rebuild_rollups
+from demo_template import mark_demo_users
 import os
 from dotenv import load_dotenv
 
@@ -8,15 +14,145 @@ load_dotenv()
 
 DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./echotrail.db")
 
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+# Engine profile: "wal" lets readers and a writer work concurrently,
+# "default" keeps SQLite's rollback journal and built-in settings
+DB_PROFILE = os.getenv("DB_PROFILE", "wal")
+
+# Connection pool; writers still take turns, so extra connections mostly serve readers
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", "10"))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", "20"))
+DB_POOL_TIMEOUT = int(os.getenv("DB_POOL_TIMEOUT", "30"))
+
+SQLITE_PROFILES = {
+    "default": {},
+    "wal": {
+        # Lets deletes hand pages back with PRAGMA incremental_vacuum; only
+        # takes effect on new databases, existing ones need one VACUUM
+        "auto_vacuum": "INCREMENTAL",
+        "journal_mode": "WAL",
+        # Durable at checkpoints; a power loss can drop only the latest commits
+        "synchronous": os.getenv("DB_SYNCHRONOUS", "NORMAL"),
+        # Per connection, in KiB when negative. The sync and async pools can each
+        # open DB_POOL_SIZE + DB_MAX_OVERFLOW (30) connections, so 4 MiB caps the
+        # caches at 240 MiB on a 512 MB instance; mmap serves most reads anyway
+        "cache_size": int(os.getenv("DB_CACHE_SIZE", "-4096")),
+        "mmap_size": int(os.getenv("DB_MMAP_SIZE", str(256 * 1024 * 1024))),
+        # Wait for a lock instead of failing with "database is locked"
+        "busy_timeout": int(os.getenv("DB_BUSY_TIMEOUT_MS", "5000")),
+        "temp_store": "MEMORY",
+    },
+}
+
+# asyncio drivers used for the async engine, by database backend
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+def _engine_options(url: str, profile: str):
+    """create_engine keyword arguments and per-connection SQLite pragmas for url under profile"""
+    if not url.startswith("sqlite"):
+        options = {
+            "pool_size": DB_POOL_SIZE, "max_overflow": DB_MAX_OVERFLOW, "pool_timeout": DB_POOL_TIMEOUT, "pool_pre_ping": True
+        }
+        return options, {}
+    
+    if profile not in SQLITE_PROFILES:
+        raise ValueError(f"Unknown DB_PROFILE '{profile}', expected one of {sorted(SQLITE_PROFILES)}")
+    pragmas = SQLITE_PROFILES[profile]
+    in_memory = make_url(url).database in (None, "", ":memory:")
+    
+    options = {"connect_args": {"check_same_thread": False}}
+    if not pragmas or in_memory:
+        return options, {}
+    options.update(pool_size=DB_POOL_SIZE, max_overflow=DB_MAX_OVERFLOW, pool_timeout=DB_POOL_TIMEOUT)
+    return options, pragmas
+
+def _set_pragmas_on_connect(engine: Engine, pragmas):
+    if not pragmas:
+        return
+    
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        for name, value in pragmas.items():
+            cursor.execute(f"PRAGMA {name} = {value}")
+        cursor.close()
+
+def create_database_engine(url: str = DATABASE_URL, profile: str = DB_PROFILE) -> Engine:
+    """Engine for url, with the pragmas and pool of the named profile on SQLite"""
+    options, pragmas = _engine_options(url, profile)
+    engine = create_engine(url, **options)
+    _set_pragmas_on_connect(engine, pragmas)
+    return engine
+
+def async_database_url(url: str) -> str:
+    """url with its driver swapped for the asyncio one, e.g. sqlite:// -> sqlite+aiosqlite://"""
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend not in ASYNC_DRIVERS:
+        raise ValueError(f"No asyncio driver configured for '{backend}' databases")
+    return parsed.set(drivername=ASYNC_DRIVERS[backend]).render_as_string(hide_password=False)
+
+def create_async_database_engine(url: str = DATABASE_URL, profile: str = DB_PROFILE) -> AsyncEngine:
+    """Asyncio engine for the same database and profile as create_database_engine(url, profile)"""
+    options, pragmas = _engine_options(url, profile)
+    if "pool_size" in options and url.startswith("sqlite"):
+        # aiosqlite opens a connection per checkout unless told to pool
+        options["poolclass"] = AsyncAdaptedQueuePool
+    engine = create_async_engine(async_database_url(url), **options)
+    _set_pragmas_on_connect(engine.sync_engine, pragmas)
+    return engine
+
+engine = create_database_engine()
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
 
+# Endpoints that only wait on the database use the async engine, so they
+# run on the event loop instead of holding a threadpool thread each
+async_engine = create_async_database_engine()
+AsyncSessionLocal = async_sessionmaker(async_engine, autoflush=False, expire_on_commit=False)
+
+def add_missing_columns():
+    """Add nullable columns introduced since a table was created - create_all never alters tables"""
+    inspector = inspect(engine)
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                continue
+            existing = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name not in existing and column.nullable and not column.primary_key:
+                    column_type = column.type.compile(dialect=engine.dialect)
+                    conn.execute(text(f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column_type}'))
+
 def create_tables():
+    add_missing_columns()
+    had_rollups = inspect(engine).has_table(DailyNoteStats.__tablename__)
     Base.metadata.create_all(bind=engine)
+    # create_all skips tables that already exist, so add indexes introduced since
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
+    if create_search_index(engine):
+        register_search_index(async_engine.sync_engine)
+    db = SessionLocal()
+    try:
+        if not had_rollups:
+            # Backfill rollups for notes written before the table existed
+            rebuild_rollups(db)
+        # Flag demo accounts created before users.is_demo existed
+        mark_demo_users(db)
+    finally:
+        db.close()
 
 def get_db():
     db = SessionLocal()
     try:
         yield db
     finally:
-        db.close()
\ No newline at end of file
+        db.close()
+
+async def get_async_db():
+    async with AsyncSessionLocal() as db:
+        yield db
@@ -0,0 +1,119 @@
+"""
+Demo template - the public demo dataset built once per process as
+insert-ready rows, so provisioning a visitor is a few set-based inserts
+"""
+from datetime import datetime
+from typing import List, Dict, Any, Tuple
+import json
+import re
+import secrets
+
+from sqlalchemy.orm import Session
+
+import models
+from bulk import note_row, moment_row
+from rollups import note_deltas
+
+PUBLIC_DEMO_EMAIL_PREFIX = "public-demo-"
+PUBLIC_DEMO_EMAIL_DOMAIN = "echotrail.ai"
+
+# Addresses /demo/public has generated: a timestamp in older releases, random hex since
+GENERATED_DEMO_EMAIL = re.compile(
+    rf"{re.escape(PUBLIC_DEMO_EMAIL_PREFIX)}(\d+|[0-9a-f]{{16}})@{re.escape(PUBLIC_DEMO_EMAIL_DOMAIN)}"
+)
+
+def public_demo_email() -> str:
+    """A fresh address for a public demo visitor"""
+    return f"{PUBLIC_DEMO_EMAIL_PREFIX}{secrets.token_hex(8)}@{PUBLIC_DEMO_EMAIL_DOMAIN}"
+
+def is_reserved_demo_email(email: str) -> bool:
+    """Whether an address is in the namespace public demo accounts are created in"""
+    email = email.lower()
+    return email.startswith(PUBLIC_DEMO_EMAIL_PREFIX) and email.endswith(f"@{PUBLIC_DEMO_EMAIL_DOMAIN}")
+
+def mark_demo_users(db: Session) -> int:
+    """Set is_demo on users created before the flag existed; returns demo users found
+
+    Only addresses /demo/public generated count as demo accounts, so a
+    registered user whose address merely starts with the prefix is kept.
+    """
+    unmarked = db.query(models.User.id, models.User.email).filter(models.User.is_demo.is_(None)).all()
+    if not unmarked:
+        return 0
+    demo_ids = [user.id for user in unmarked if GENERATED_DEMO_EMAIL.fullmatch(user.email)]
+    if demo_ids:
+        db.query(models.User).filter(models.User.id.in_(demo_ids)).update(
+            {models.User.is_demo: True}, synchronize_session=False
+        )
+    db.query(models.User).filter(models.User.is_demo.is_(None)).update(
+        {models.User.is_demo: False}, synchronize_session=False
+    )
+    db.commit()
+    return len(demo_ids)
+
+class DemoTemplate:
+    """Demo note and moment rows with their dates kept as offsets from when they were built
+
+    Provisioning re-anchors the offsets to the current time, so every
+    visitor sees the same recent-looking history however long the process
+    has been running.
+    """
+
+    def __init__(self, notes: List[Dict[str, Any]], precomputed_moments: List[Dict[str, Any]] = (),
+                 built_at: datetime = None):
+        built_at = built_at or datetime.utcnow()
+
+        self.note_rows = []
+        for note in notes:
+            row = note_row(None, note, now=built_at)
+            row['created_at'] -= built_at
+            row['updated_at'] -= built_at
+            self.note_rows.append(row)
+
+        # Moments list their notes by 1-based position in the dataset
+        self.moment_rows = []
+        for moment in precomputed_moments:
+            row = moment_row(None, dict(
+                moment,
+                start_date=datetime.fromisoformat(moment['start_date']) - built_at,
+                end_date=datetime.fromisoformat(moment['end_date']) - built_at
+            ))
+            row['note_ids'] = [position - 1 for position in moment['note_ids']]
+            self.moment_rows.append(row)
+
+    def provision(self, db: Session, user_id: int, now: datetime = None) -> Tuple[int, int]:
+        """Copy the template to a user without notes in one transaction; returns (notes, moments) created"""
+        now = now or datetime.utcnow()
+        notes = [
+            dict(row, user_id=user_id, created_at=now + row['created_at'], updated_at=now + row['updated_at'])
+            for row in self.note_rows
+        ]
+        # Core statements: the rows are complete, so the ORM has nothing to add
+        result = db.execute(
+            models.Note.__table__.insert().returning(models.Note.id, sort_by_parameter_order=True), notes
+        )
+        note_ids = result.scalars().all()
+
+        # The user starts without notes, so their rollups are inserted outright
+        rollups = [
+            {'user_id': user_id, 'day': day, 'mood': mood,
+             'note_count': note_count, 'energy_sum': energy_sum, 'energy_count': energy_count}
+            for (day, mood), (note_count, energy_sum, energy_count) in note_deltas(notes).items()
+        ]
+        if rollups:
+            db.execute(models.DailyNoteStats.__table__.insert(), rollups)
+
+        moments = [
+            dict(
+                row,
+                user_id=user_id,
+                start_date=now + row['start_date'],
+                end_date=now + row['end_date'],
+                note_ids=json.dumps([note_ids[index] for index in row['note_ids']])
+            )
+            for row in self.moment_rows
+        ]
+        if moments:
+            db.execute(models.Moment.__table__.insert(), moments)
+        db.commit()
+        return len(note_ids), len(moments)
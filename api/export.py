@@ -0,0 +1,127 @@
+"""
+Account export - a user's notes and moments as JSON lines, streamed from
+server-side cursors in fixed-size batches so memory does not grow with
+the size of the account
+"""
+from datetime import datetime
+from typing import AsyncIterator, Dict, Any
+import base64
+import json
+import os
+import zlib
+
+from sqlalchemy import select
+
+import models
+from database import AsyncSessionLocal
+
+EXPORT_FORMAT_VERSION = 1
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "500"))
+EXPORT_GZIP_LEVEL = 6
+
+# Most bytes one gzip chunk may inflate to before the next is read
+GUNZIP_PIECE_SIZE = 1024 * 1024
+
+def _line(record: Dict[str, Any]) -> bytes:
+    return json.dumps(record, ensure_ascii=False, separators=(",", ":")).encode() + b"\n"
+
+def _image_data_url(content_type: str, data: bytes) -> str:
+    return f"data:{content_type};base64,{base64.b64encode(data).decode()}"
+
+def note_record(note, image_content_type=None, image_bytes=None) -> Dict[str, Any]:
+    """Export line for a note row, with its image inlined so another instance can import it"""
+    image_data = note.image_data
+    if image_bytes is not None:
+        image_data = _image_data_url(image_content_type, image_bytes)
+    return {
+        "type": "note",
+        "id": note.id,
+        "title": note.title,
+        "content": note.content,
+        "mood": note.mood,
+        "energy_level": note.energy_level,
+        "image_data": image_data,
+        "created_at": note.created_at.isoformat(),
+        "updated_at": note.updated_at.isoformat() if note.updated_at else None
+    }
+
+def moment_record(moment: models.Moment) -> Dict[str, Any]:
+    """Export line for a moment; note_ids refer to the exported note ids"""
+    return {
+        "type": "moment",
+        "title": moment.title,
+        "summary": moment.summary,
+        "emotional_tone": moment.emotional_tone,
+        "emotional_score": moment.emotional_score,
+        "keywords": json.loads(moment.keywords),
+        "reflection_prompt": moment.reflection_prompt,
+        "start_date": moment.start_date.isoformat(),
+        "end_date": moment.end_date.isoformat(),
+        "note_count": moment.note_count,
+        "note_ids": json.loads(moment.note_ids)
+    }
+
+async def export_lines(user_id: int) -> AsyncIterator[bytes]:
+    """A header line, then every note oldest first, then every moment - one chunk per batch
+
+    Notes come before moments so an importer has remapped every note id by
+    the time it reads the moments that refer to them.
+    """
+    yield _line({
+        "type": "export",
+        "version": EXPORT_FORMAT_VERSION,
+        "exported_at": datetime.utcnow().isoformat()
+    })
+
+    # Own session: the response body is sent after request dependencies close
+    async with AsyncSessionLocal() as db:
+        notes = select(
+            models.Note.id,
+            models.Note.title,
+            models.Note.content,
+            models.Note.mood,
+            models.Note.energy_level,
+            models.Note.image_data,
+            models.Note.created_at,
+            models.Note.updated_at,
+            models.Image.content_type,
+            models.Image.data
+        ).outerjoin(
+            models.Image, models.Image.content_hash == models.Note.image_hash
+        ).where(
+            models.Note.user_id == user_id
+        ).order_by(models.Note.created_at, models.Note.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+        result = await db.stream(notes)
+        async for rows in result.partitions():
+            yield b"".join(_line(note_record(row, row.content_type, row.data)) for row in rows)
+
+        moments = select(models.Moment).where(
+            models.Moment.user_id == user_id
+        ).order_by(models.Moment.start_date, models.Moment.id).execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+        result = await db.stream_scalars(moments)
+        async for batch in result.partitions():
+            yield b"".join(_line(moment_record(moment)) for moment in batch)
+
+async def gzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Compress a byte stream into a single gzip member as it is produced"""
+    compressor = zlib.compressobj(EXPORT_GZIP_LEVEL, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+async def gunzip_chunks(chunks: AsyncIterator[bytes]) -> AsyncIterator[bytes]:
+    """Inflate a gzip byte stream a bounded piece at a time"""
+    decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+    async for chunk in chunks:
+        while chunk:
+            data = decompressor.decompress(chunk, GUNZIP_PIECE_SIZE)
+            chunk = decompressor.unconsumed_tail
+            if data:
+                yield data
+    remaining = decompressor.flush()
+    if remaining:
+        yield remaining
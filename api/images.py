@@ -0,0 +1,130 @@
+"""
+Note images - decoded once and stored by content hash in their own table, so
+note rows and list responses stay small and identical images are kept once
+"""
+from typing import Iterable, List, Optional, Tuple
+import base64
+import binascii
+import hashlib
+import re
+
+from sqlalchemy import insert, select, update
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import models
+
+# Notes moved from inline base64 to the images table per transaction
+MIGRATION_BATCH_SIZE = 200
+
+# Clients cache an image for a year; its URL changes whenever its bytes do
+IMAGE_CACHE_CONTROL = "private, max-age=31536000, immutable"
+
+_DATA_URL = re.compile(r"^data:(?P<content_type>[\w.+-]+/[\w.+-]+)?(;[^,]*)?;base64,", re.IGNORECASE)
+
+_SIGNATURES = [
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+]
+
+def _sniff_content_type(data: bytes) -> str:
+    for signature, content_type in _SIGNATURES:
+        if data.startswith(signature):
+            return content_type
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    return "application/octet-stream"
+
+def parse_image_data(image_data: str) -> Tuple[bytes, str]:
+    """Bytes and content type of a base64 image, with or without a data: URL prefix"""
+    content_type = None
+    match = _DATA_URL.match(image_data)
+    if match:
+        content_type = match.group("content_type")
+        image_data = image_data[match.end():]
+    try:
+        data = base64.b64decode(image_data, validate=True)
+    except (binascii.Error, ValueError):
+        raise ValueError("image_data is not valid base64")
+    return data, content_type or _sniff_content_type(data)
+
+def store_images(db: Session, images: List[Optional[str]]) -> List[Optional[str]]:
+    """Store base64 images once each, returning their content hashes; does not commit"""
+    hashes = []
+    rows = {}
+    for image_data in images:
+        if not image_data:
+            hashes.append(None)
+            continue
+        data, content_type = parse_image_data(image_data)
+        content_hash = hashlib.sha256(data).hexdigest()
+        hashes.append(content_hash)
+        rows[content_hash] = {
+            'content_hash': content_hash, 'content_type': content_type, 'size': len(data), 'data': data
+        }
+
+    if rows:
+        dialect = db.get_bind().dialect.name
+        if dialect in ("sqlite", "postgresql"):
+            # Always write: on SQLite this takes the write lock, so a delete_note
+            # dropping the same image cannot slip in before this note commits
+            dialect_insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+            db.execute(dialect_insert(models.Image).on_conflict_do_nothing(
+                index_elements=[models.Image.content_hash]
+            ), list(rows.values()))
+        else:
+            existing = {
+                row.content_hash for row in db.query(models.Image.content_hash).filter(
+                    models.Image.content_hash.in_(list(rows))
+                )
+            }
+            missing = [row for content_hash, row in rows.items() if content_hash not in existing]
+            if missing:
+                db.execute(insert(models.Image), missing)
+    return hashes
+
+def delete_unreferenced_images(db: Session, content_hashes: Iterable[Optional[str]]) -> int:
+    """Delete these images if no note refers to them any more; does not commit
+
+    Image URLs work without auth, so an image must go once its last note does.
+    """
+    content_hashes = {content_hash for content_hash in content_hashes if content_hash}
+    if not content_hashes:
+        return 0
+    referenced = select(models.Note.image_hash).where(models.Note.image_hash.in_(content_hashes))
+    return db.query(models.Image).filter(
+        models.Image.content_hash.in_(content_hashes),
+        models.Image.content_hash.not_in(referenced)
+    ).delete(synchronize_session=False)
+
+def migrate_inline_images(db: Session) -> int:
+    """Move base64 images still stored on notes into the images table; returns notes moved"""
+    moved = 0
+    last_id = 0
+    while True:
+        notes = db.query(models.Note.id, models.Note.image_data, models.Note.updated_at).filter(
+            models.Note.id > last_id,
+            models.Note.image_data.isnot(None),
+            models.Note.image_hash.is_(None)
+        ).order_by(models.Note.id).limit(MIGRATION_BATCH_SIZE).all()
+        if not notes:
+            return moved
+
+        updates = []
+        for note in notes:
+            try:
+                image_hash = store_images(db, [note.image_data])[0]
+            except ValueError:
+                print(f"Skipping unreadable image on note {note.id}")
+                continue
+            # Keep updated_at: moving storage does not edit the note
+            updates.append({
+                'id': note.id, 'image_hash': image_hash, 'image_data': None, 'updated_at': note.updated_at
+            })
+        if updates:
+            db.execute(update(models.Note), updates)
+            moved += len(updates)
+        last_id = notes[-1].id
+        db.commit()
@@ -0,0 +1,259 @@
+"""
+Incremental analysis - keeps each user's fitted vocabulary, note vectors and
+clusters between runs so small edits only touch the affected notes and moments
+"""
+from collections import OrderedDict
+from typing import List, Dict, Any, Optional
+import threading
+import os
+
+import numpy as np
+import scipy.sparse as sp
+
+from analyzer import MomentAnalyzer, TEXT_WEIGHT, TEMPORAL_WEIGHT, TEMPORAL_DECAY_SECONDS, epoch_seconds
+from metrics import StageTimer
+
+# Fraction of notes that may change before the state is rebuilt from scratch
+INCREMENTAL_REBUILD_RATIO = float(os.getenv("INCREMENTAL_REBUILD_RATIO", "0.2"))
+INCREMENTAL_MAX_USERS = int(os.getenv("INCREMENTAL_MAX_USERS", "256"))
+
+def _note_version(note: Dict[str, Any]):
+    return note.get('updated_at'), note['title'], note['content'], note['created_at']
+
+class UserAnalysisState:
+    """Fitted vocabulary, note vectors and cluster labels from one user's analysis"""
+
+    def __init__(self, analyzer: MomentAnalyzer, notes: List[Dict[str, Any]], min_cluster_size: int,
+                 timer: StageTimer = None):
+        self.analyzer = analyzer
+        self.min_cluster_size = min_cluster_size
+        self.lock = threading.Lock()
+        self.moments = {}
+        self.rebuild(notes, timer)
+
+    def rebuild(self, notes: List[Dict[str, Any]], timer: StageTimer = None):
+        """Fit vocabulary and clusters over all notes, as a full analysis would"""
+        timer = timer or StageTimer()
+        with timer.stage('preprocess'):
+            notes_sorted = sorted(notes, key=lambda x: x['created_at'])
+            texts = [self.analyzer.note_text(note) for note in notes_sorted]
+            timestamps = [note['created_at'] for note in notes_sorted]
+
+        with timer.stage('vectorize'):
+            self.vectorizer, matrix = self.analyzer.vectorize(texts)
+        clusters = self.analyzer.cluster_matrix(matrix, timestamps, min_cluster_size=1, timer=timer)
+
+        labels = np.empty(len(notes_sorted), dtype=np.int64)
+        for label, indices in enumerate(clusters):
+            labels[indices] = label
+
+        self.matrix = matrix.tocsr()
+        self.seconds = epoch_seconds(timestamps)
+        self.labels = labels
+        self.next_label = len(clusters)
+        self.notes = {note['id']: note for note in notes_sorted}
+        self.rows = {note['id']: row for row, note in enumerate(notes_sorted)}
+        self.changes = 0
+        self.size_at_rebuild = len(notes_sorted)
+        self.join_threshold = self._join_threshold(clusters)
+
+    def _similarities(self, row: int) -> np.ndarray:
+        """Combined text/temporal similarity of one row against every row"""
+        text_similarity = np.asarray((self.matrix @ self.matrix[row].T).todense()).ravel()
+        time_diff = np.abs(self.seconds - self.seconds[row])
+        temporal_similarity = np.exp(-time_diff / TEMPORAL_DECAY_SECONDS)
+        return TEXT_WEIGHT * text_similarity + TEMPORAL_WEIGHT * temporal_similarity
+
+    def _join_threshold(self, clusters: List[List[int]]) -> float:
+        """Weakest average-linkage fit of any note to its own multi-note cluster"""
+        threshold = np.inf
+        for indices in clusters:
+            size = len(indices)
+            if size < 2:
+                continue
+            rows = self.matrix[indices]
+            text_similarity = (rows @ rows.T).toarray()
+            time_diff = np.abs(self.seconds[indices][:, None] - self.seconds[indices][None, :])
+            similarity = TEXT_WEIGHT * text_similarity + TEMPORAL_WEIGHT * np.exp(-time_diff / TEMPORAL_DECAY_SECONDS)
+            # Average similarity of each note to the other members, excluding itself
+            fit = (similarity.sum(axis=1) - np.diag(similarity)) / (size - 1)
+            threshold = min(threshold, float(fit.min()))
+        return threshold
+
+    def needs_rebuild(self, pending_changes: int, min_cluster_size: int) -> bool:
+        """Whether too much has changed for incremental updates to stay faithful"""
+        if min_cluster_size != self.min_cluster_size:
+            return True
+        budget = max(1, int(self.size_at_rebuild * INCREMENTAL_REBUILD_RATIO))
+        return self.changes + pending_changes > budget
+
+    def remove(self, note_id: int):
+        """Drop a note from its cluster without refitting anything"""
+        row = self.rows.pop(note_id)
+        del self.notes[note_id]
+        self.labels[row] = -1
+        self.changes += 1
+
+    def add(self, notes: List[Dict[str, Any]], timer: StageTimer = None):
+        """Vectorize new notes with the fitted vocabulary and attach them to clusters"""
+        if not notes:
+            return
+
+        timer = timer or StageTimer()
+        with timer.stage('preprocess'):
+            notes_sorted = sorted(notes, key=lambda x: x['created_at'])
+            texts = [self.analyzer.note_text(note) for note in notes_sorted]
+        first_row = self.matrix.shape[0]
+
+        with timer.stage('vectorize'):
+            self.matrix = sp.vstack([self.matrix, self.vectorizer.transform(texts)], format='csr')
+        self.seconds = np.concatenate([
+            self.seconds, epoch_seconds([note['created_at'] for note in notes_sorted])
+        ])
+        self.labels = np.concatenate([self.labels, np.full(len(notes_sorted), -1, dtype=np.int64)])
+
+        with timer.stage('cluster'):
+            for offset, note in enumerate(notes_sorted):
+                row = first_row + offset
+                self.labels[row] = self._best_cluster(row)
+                self.notes[note['id']] = note
+                self.rows[note['id']] = row
+                self.changes += 1
+
+    def _best_cluster(self, row: int) -> int:
+        """Cluster with the highest average similarity to the row, or a new one"""
+        alive = self.labels >= 0
+        if alive.any():
+            similarity = self._similarities(row)[alive]
+            labels = self.labels[alive]
+            totals = np.bincount(labels, weights=similarity)
+            sizes = np.bincount(labels)
+            scores = np.where(sizes > 0, totals / np.maximum(sizes, 1), -np.inf)
+            best = int(np.argmax(scores))
+            if scores[best] >= self.join_threshold:
+                return best
+
+        label = self.next_label
+        self.next_label += 1
+        return label
+
+    def clusters(self) -> List[List[Dict[str, Any]]]:
+        """Current clusters as date-ordered notes, honoring the minimum cluster size"""
+        members = {}
+        for note_id, row in self.rows.items():
+            members.setdefault(int(self.labels[row]), []).append(self.notes[note_id])
+
+        clusters = []
+        for cluster_notes in members.values():
+            cluster_notes.sort(key=lambda x: x['created_at'])
+            if len(cluster_notes) >= self.min_cluster_size:
+                clusters.append(cluster_notes)
+            else:
+                clusters.extend([note] for note in cluster_notes)
+        return clusters
+
+    def build_moments(self, timer: StageTimer = None) -> List[Dict[str, Any]]:
+        """Moments for the current clusters, regenerating only changed ones"""
+        timer = timer or StageTimer()
+        moments = {}
+        changed = []
+        for cluster_notes in self.clusters():
+            # Edited notes keep their id, so the key carries each note's version too
+            key = tuple((note['id'], _note_version(note)) for note in cluster_notes)
+            moments[key] = self.moments.get(key)
+            if moments[key] is None:
+                changed.append((key, cluster_notes))
+
+        if changed:
+            # Keywords come from the fitted corpus matrix, like in a full analysis
+            with timer.stage('keywords'):
+                keywords = self.analyzer.cluster_keywords(
+                    self.matrix,
+                    self.vectorizer.get_feature_names_out(),
+                    [[self.rows[note_id] for note_id, _ in key] for key, _ in changed]
+                )
+            with timer.stage('sentiment'):
+                self.analyzer.fill_polarities([note for _, cluster_notes in changed for note in cluster_notes])
+            with timer.stage('moments'):
+                built = self.analyzer.build_moments([cluster_notes for _, cluster_notes in changed], keywords)
+            for (key, _), moment in zip(changed, built):
+                moments[key] = moment
+
+        # Only keep moments for clusters that still exist
+        self.moments = moments
+        return sorted(moments.values(), key=lambda x: x['start_date'])
+
+class IncrementalAnalyzer:
+    """Per-user incremental analysis on top of a shared MomentAnalyzer"""
+
+    def __init__(self, analyzer: MomentAnalyzer, max_users: int = INCREMENTAL_MAX_USERS):
+        self.analyzer = analyzer
+        self.max_users = max_users
+        self._states = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _get_state(self, user_id: int) -> Optional[UserAnalysisState]:
+        with self._lock:
+            state = self._states.get(user_id)
+            if state is not None:
+                self._states.move_to_end(user_id)
+            return state
+
+    def _set_state(self, user_id: int, state: UserAnalysisState):
+        with self._lock:
+            self._states[user_id] = state
+            self._states.move_to_end(user_id)
+            while len(self._states) > self.max_users:
+                self._states.popitem(last=False)
+
+    def discard(self, user_id: int):
+        """Forget a user's state, e.g. after their notes were replaced wholesale"""
+        with self._lock:
+            self._states.pop(user_id, None)
+
+    def analyze_notes(self, user_id: int, notes: List[Dict[str, Any]], min_cluster_size: int = 2,
+                      timer: StageTimer = None) -> List[Dict[str, Any]]:
+        """Analyze a user's notes, updating the previous run's state where possible"""
+        if not notes:
+            self.discard(user_id)
+            return []
+
+        state = self._get_state(user_id)
+        if state is None:
+            return self._analyze_from_scratch(user_id, notes, min_cluster_size, timer)
+
+        with state.lock:
+            current = {note['id']: note for note in notes}
+            removed = [
+                note_id for note_id, note in state.notes.items()
+                if note_id not in current or _note_version(current[note_id]) != _note_version(note)
+            ]
+            added = [
+                note for note_id, note in current.items()
+                if note_id not in state.notes or note_id in removed
+            ]
+
+            if state.needs_rebuild(len(removed) + len(added), min_cluster_size):
+                return self._analyze_from_scratch(user_id, notes, min_cluster_size, timer)
+
+            for note_id in removed:
+                state.remove(note_id)
+            state.add(added, timer)
+            return state.build_moments(timer)
+
+    def _analyze_from_scratch(self, user_id: int, notes: List[Dict[str, Any]], min_cluster_size: int,
+                              timer: StageTimer = None) -> List[Dict[str, Any]]:
+        if len(notes) < 2:
+            self.discard(user_id)
+            return self.analyzer.analyze_notes(notes, min_cluster_size, timer)
+
+        try:
+            state = UserAnalysisState(self.analyzer, notes, min_cluster_size, timer)
+        except ValueError:
+            # Empty vocabulary (e.g. only stop words) - nothing to keep incrementally
+            self.discard(user_id)
+            return self.analyzer.analyze_notes(notes, min_cluster_size, timer)
+
+        self._set_state(user_id, state)
+        with state.lock:
+            return state.build_moments(timer)
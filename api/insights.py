@@ -0,0 +1,135 @@
+"""
+Insight statistics - read from the daily rollups, or aggregated in SQL for
+arbitrary date ranges, so cost does not grow with the number of note rows
+loaded into Python
+"""
+from datetime import datetime, timedelta
+from typing import Dict, Any, Optional
+
+from sqlalchemy import case, func
+from sqlalchemy.orm import Session
+
+import models
+
+TREND_DAYS = 30
+RECENT_ACTIVITY_DAYS = 7
+
+def insights_stats(db: Session, user_id: int, start_date: Optional[datetime] = None,
+                   end_date: Optional[datetime] = None) -> Dict[str, Any]:
+    """Mood distribution, daily energy trends and activity for a user's notes"""
+    if start_date is None and end_date is None:
+        return rollup_stats(db, user_id)
+
+    note_filters = [models.Note.user_id == user_id]
+    moment_filters = [models.Moment.user_id == user_id]
+    if start_date:
+        note_filters.append(models.Note.created_at >= start_date)
+        moment_filters.append(models.Moment.end_date >= start_date)
+    if end_date:
+        note_filters.append(models.Note.created_at <= end_date)
+        moment_filters.append(models.Moment.start_date <= end_date)
+
+    recent_cutoff = datetime.utcnow() - timedelta(days=RECENT_ACTIVITY_DAYS)
+    total_notes, first_note, last_note, recent_activity = db.query(
+        func.count(models.Note.id),
+        func.min(models.Note.created_at),
+        func.max(models.Note.created_at),
+        func.sum(case((models.Note.created_at >= recent_cutoff, 1), else_=0))
+    ).filter(*note_filters).one()
+
+    if not total_notes:
+        return {
+            "total_notes": 0,
+            "total_moments": 0,
+            "mood_distribution": {},
+            "energy_trends": [],
+            "recent_activity": 0
+        }
+
+    total_moments = db.query(func.count(models.Moment.id)).filter(*moment_filters).scalar()
+
+    mood_distribution = dict(
+        db.query(models.Note.mood, func.count(models.Note.id)).filter(*note_filters).group_by(models.Note.mood)
+    )
+
+    # Daily averages for the latest days with notes, oldest first
+    day = func.date(models.Note.created_at)
+    trend_rows = db.query(
+        day, func.avg(models.Note.energy_level), func.count(models.Note.id)
+    ).filter(*note_filters).group_by(day).order_by(day.desc()).limit(TREND_DAYS).all()
+    energy_trends = [
+        {
+            "date": date_str,
+            "average_energy": round(avg_energy, 1) if avg_energy is not None else None,
+            "note_count": note_count
+        }
+        for date_str, avg_energy, note_count in reversed(trend_rows)
+    ]
+
+    return {
+        "total_notes": total_notes,
+        "total_moments": total_moments,
+        "mood_distribution": mood_distribution,
+        "energy_trends": energy_trends,
+        "recent_activity": recent_activity or 0,
+        "date_range": {
+            "start": first_note.isoformat(),
+            "end": last_note.isoformat()
+        }
+    }
+
+def rollup_stats(db: Session, user_id: int) -> Dict[str, Any]:
+    """insights_stats over all time, from the per-day rollups plus two index lookups"""
+    Stats = models.DailyNoteStats
+    mood_distribution = {
+        mood or None: int(count)
+        for mood, count in db.query(Stats.mood, func.sum(Stats.note_count)).filter(
+            Stats.user_id == user_id
+        ).group_by(Stats.mood)
+        if count
+    }
+    total_notes = sum(mood_distribution.values())
+
+    if not total_notes:
+        return {
+            "total_notes": 0,
+            "total_moments": 0,
+            "mood_distribution": {},
+            "energy_trends": [],
+            "recent_activity": 0
+        }
+
+    trend_rows = db.query(
+        Stats.day, func.sum(Stats.energy_sum), func.sum(Stats.energy_count), func.sum(Stats.note_count)
+    ).filter(Stats.user_id == user_id).group_by(Stats.day).order_by(Stats.day.desc()).limit(TREND_DAYS).all()
+    energy_trends = [
+        {
+            "date": day.isoformat(),
+            "average_energy": round(energy_sum / energy_count, 1) if energy_count else None,
+            "note_count": int(note_count)
+        }
+        for day, energy_sum, energy_count, note_count in reversed(trend_rows)
+    ]
+
+    # Exact timestamps come from the (user_id, created_at) index, not a scan
+    notes = db.query(models.Note).filter(models.Note.user_id == user_id)
+    first_note, last_note = notes.with_entities(
+        func.min(models.Note.created_at), func.max(models.Note.created_at)
+    ).one()
+    recent_cutoff = datetime.utcnow() - timedelta(days=RECENT_ACTIVITY_DAYS)
+    recent_activity = notes.filter(models.Note.created_at >= recent_cutoff).with_entities(
+        func.count(models.Note.id)
+    ).scalar()
+    total_moments = db.query(func.count(models.Moment.id)).filter(models.Moment.user_id == user_id).scalar()
+
+    return {
+        "total_notes": total_notes,
+        "total_moments": total_moments,
+        "mood_distribution": mood_distribution,
+        "energy_trends": energy_trends,
+        "recent_activity": recent_activity,
+        "date_range": {
+            "start": first_note.isoformat(),
+            "end": last_note.isoformat()
+        }
+    }
@@ -0,0 +1,196 @@
+"""
+Background analysis jobs - run the CPU-bound pipeline in a bounded process pool
+so long analyses never hold a request thread
+"""
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from typing import List, Dict, Any, Optional, Callable
+import multiprocessing
+import threading
+import time
+import uuid
+import os
+
+from metrics import StageTimer, record_stage_timings
+
+ANALYSIS_JOB_WORKERS = int(os.getenv("ANALYSIS_JOB_WORKERS", "2"))
+ANALYSIS_JOB_RETENTION_SECONDS = int(os.getenv("ANALYSIS_JOB_RETENTION_SECONDS", "3600"))
+
+ACTIVE_STATUSES = ("queued", "running", "persisting")
+
+# One analyzer per worker process, created on its first job
+_worker_analyzer = None
+
+def run_analysis(notes_data: List[Dict[str, Any]], min_cluster_size: int, analyzer_options: Dict[str, Any]):
+    """Worker entry point: score missing sentiments and build moments"""
+    global _worker_analyzer
+    if _worker_analyzer is None:
+        from analyzer import MomentAnalyzer
+        _worker_analyzer = MomentAnalyzer(**analyzer_options)
+
+    timer = StageTimer()
+    with timer.stage('sentiment'):
+        new_scores = _worker_analyzer.fill_polarities(notes_data)
+    moments = _worker_analyzer.analyze_notes(notes_data, min_cluster_size=min_cluster_size, timer=timer)
+    return moments, new_scores, timer.timings
+
+class AnalysisJob:
+    """State of one analysis request as seen by polling clients"""
+
+    def __init__(self, user_id: int, notes_hash: str, total_notes: int):
+        self.id = uuid.uuid4().hex
+        self.user_id = user_id
+        self.notes_hash = notes_hash
+        self.total_notes = total_notes
+        self.status = "queued"
+        self.progress = 0.0
+        self.moments = None
+        self.cache_hit = False
+        self.error = None
+        self.created_at = datetime.utcnow()
+        self.finished_at = None
+        self.future = None
+        # Id of a newer job for the same user whose results replace this one's
+        self.superseded_by = None
+
+    def finish(self, moments: List[Dict[str, Any]] = None, error: str = None):
+        self.moments = moments
+        self.error = error
+        self.status = "failed" if error else "completed"
+        self.progress = 1.0
+        self.finished_at = datetime.utcnow()
+
+    def supersede(self):
+        self.status = "superseded"
+        self.progress = 1.0
+        self.finished_at = datetime.utcnow()
+
+    def to_dict(self) -> Dict[str, Any]:
+        if self.status == "queued" and self.future is not None and self.future.running():
+            self.status = "running"
+            self.progress = 0.1
+
+        job = {
+            "job_id": self.id,
+            "status": self.status,
+            "progress": self.progress,
+            "total_notes": self.total_notes,
+            "cache_hit": self.cache_hit,
+            "created_at": self.created_at,
+            "finished_at": self.finished_at,
+            "error": self.error,
+            "superseded_by": self.superseded_by
+        }
+        if self.status == "completed":
+            job["moments"] = self.moments
+            job["analysis_time"] = (self.finished_at - self.created_at).total_seconds()
+        return job
+
+class AnalysisJobManager:
+    """Tracks analysis jobs and coalesces duplicate requests for the same notes
+
+    A user's newest job supersedes their older ones: queued jobs are
+    cancelled and running ones finish without writing, so a stale analysis
+    that completes late never overwrites newer moments.
+    """
+
+    def __init__(self, persist: Callable, max_workers: int = ANALYSIS_JOB_WORKERS, analyzer_options: Dict[str, Any] = None):
+        # persist(job, moments, new_scores) writes results back from a pool callback thread
+        self.persist = persist
+        self.max_workers = max_workers
+        self.analyzer_options = analyzer_options or {}
+        self._jobs = {}
+        self._lock = threading.Lock()
+        # Held while persisting so a superseded job cannot write after its replacement
+        self._persist_lock = threading.Lock()
+        self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # spawn avoids forking a process that is already running server threads
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.max_workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def _prune(self):
+        cutoff = datetime.utcnow() - timedelta(seconds=ANALYSIS_JOB_RETENTION_SECONDS)
+        for job_id in [job_id for job_id, job in self._jobs.items() if job.finished_at and job.finished_at < cutoff]:
+            del self._jobs[job_id]
+
+    def _find_active(self, user_id: int, notes_hash: str) -> Optional[AnalysisJob]:
+        for job in self._jobs.values():
+            if (job.user_id == user_id and job.notes_hash == notes_hash
+                    and job.status in ACTIVE_STATUSES and job.superseded_by is None):
+                return job
+        return None
+
+    def _register(self, job: AnalysisJob):
+        """Add a job, superseding the user's other active jobs; call with the lock held"""
+        self._prune()
+        for other in self._jobs.values():
+            if other.user_id == job.user_id and other.status in ACTIVE_STATUSES and other.superseded_by is None:
+                other.superseded_by = job.id
+                if other.future is not None and other.future.cancel():
+                    other.supersede()
+        self._jobs[job.id] = job
+
+    def find_active(self, user_id: int, notes_hash: str) -> Optional[AnalysisJob]:
+        """Running job for the same user and notes, if there is one"""
+        with self._lock:
+            return self._find_active(user_id, notes_hash)
+
+    def add_finished(self, user_id: int, notes_hash: str, moments: List[Dict[str, Any]], cache_hit: bool = False) -> AnalysisJob:
+        """Record a job that needed no worker, e.g. served from the analysis cache"""
+        job = AnalysisJob(user_id, notes_hash, sum(m['note_count'] for m in moments))
+        job.cache_hit = cache_hit
+        job.finish(moments)
+        with self._lock:
+            self._register(job)
+        return job
+
+    def submit(self, user_id: int, notes_hash: str, notes_data: List[Dict[str, Any]], min_cluster_size: int) -> AnalysisJob:
+        """Start an analysis in the pool, or return the one already running for these notes"""
+        with self._lock:
+            active = self._find_active(user_id, notes_hash)
+            if active is not None:
+                return active
+
+            job = AnalysisJob(user_id, notes_hash, len(notes_data))
+            self._register(job)
+            job.future = self._get_executor().submit(
+                run_analysis, notes_data, min_cluster_size, self.analyzer_options
+            )
+
+        job.future.add_done_callback(lambda future: self._on_done(job, future))
+        return job
+
+    def _on_done(self, job: AnalysisJob, future):
+        if future.cancelled():
+            return
+        try:
+            moments, new_scores, timings = future.result()
+            with self._persist_lock:
+                if job.superseded_by is not None:
+                    job.supersede()
+                    return
+                job.status = "persisting"
+                job.progress = 0.9
+                start = time.perf_counter()
+                self.persist(job, moments, new_scores)
+                timings['persist'] = time.perf_counter() - start
+            record_stage_timings(timings)
+            job.finish(moments)
+        except Exception as e:
+            print(f"Analysis job {job.id} failed: {e}")
+            job.finish(error=str(e))
+
+    def get(self, job_id: str) -> Optional[AnalysisJob]:
+        with self._lock:
+            return self._jobs.get(job_id)
+
+    def shutdown(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
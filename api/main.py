@@ -1,18 +1,43 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from fastapi import FastAPI, Depends, HTTPException, Request, Response, status
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from fastapi.security import HTTPBearer
-from sqlalchemy.orm import Session
-from datetime import datetime, timedelta
+from pydantic import ValidationError
+from sqlalchemy import select
+from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.ext.asyncio import AsyncSession
+from starlette.concurrency import run_in_threadpool
+from starlette.routing import Match
+from sqlalchemy.orm import Session, defer
+from typing import List
+from datetime import datetime
+import asyncio
+import threading
 import time
 import json
+import os
+import zlib
 
-from database import get_db, create_tables
+from database import get_db, get_async_db, create_tables, async_engine
 import models
 import schemas
 from auth import get_password_hash, verify_password, create_access_token, get_current_user
-from analyzer import MomentAnalyzer
+from user_cache import CachedUser
+from analysis_cache import get_cached_analysis, store_analysis, hash_notes
+from sentiments import attach_polarities, load_polarities, store_polarities
+from jobs import AnalysisJobManager
+from bulk import insert_notes, insert_moments, insert_demo_dataset, clear_user_data, BULK_CHUNK_SIZE, BULK_IMPORT_MAX_NOTES
+from export import export_lines, gzip_chunks, gunzip_chunks, EXPORT_FORMAT_VERSION
+from search import search_notes
+from insights import insights_stats
+from rollups import apply_note_deltas, note_as_dict
+from images import store_images, migrate_inline_images, delete_unreferenced_images, IMAGE_CACHE_CONTROL
+from pagination import keyset_page_async, clamp_limit, NEXT_CURSOR_HEADER
+from metrics import StageTimer, REQUEST_SECONDS, record_stage_timings, render_metrics
 from judge_demo import JudgeDemoData
 from demo_data import DemoDataSeeder
+from demo_template import DemoTemplate, public_demo_email, is_reserved_demo_email
+from reaper import reap_periodically, REAPER_INTERVAL_SECONDS
 
 app = FastAPI(title="EchoTrail AI API", version="1.0.0")
 
@@ -23,20 +48,126 @@ app.add_middleware(
     allow_credentials=False,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=[NEXT_CURSOR_HEADER],
 )
 
-# Initialize components
-analyzer = MomentAnalyzer()
+def route_template(request: Request) -> str:
+    """Path template of the matched route, so metrics are not labelled per note id"""
+    for route in request.app.router.routes:
+        match, _ = route.matches(request.scope)
+        if match == Match.FULL:
+            return route.path
+    return "unmatched"
+
+@app.middleware("http")
+async def record_request_latency(request: Request, call_next):
+    start_time = time.perf_counter()
+    status_code = 500
+    try:
+        response = await call_next(request)
+        status_code = response.status_code
+        return response
+    finally:
+        REQUEST_SECONDS.observe(
+            time.perf_counter() - start_time,
+            method=request.method,
+            route=route_template(request),
+            status=status_code
+        )
+
+# off: load the analyzer on the first analysis; background: load it after
+# startup without delaying the first request; eager: load it before serving
+ANALYZER_WARMUP = os.getenv("ANALYZER_WARMUP", "background")
+
+# Initialize components - the analyzer keeps no per-call state, so it is
+# shared safely by every request thread. It is built on first use, since
+# importing scikit-learn, NumPy and TextBlob is most of the cold start
+_analyzer = None
+_incremental_analyzer = None
+_analyzer_lock = threading.Lock()
+
+def get_analyzer():
+    """The shared MomentAnalyzer, importing the ML libraries on first call"""
+    global _analyzer, _incremental_analyzer
+    if _analyzer is None:
+        with _analyzer_lock:
+            if _analyzer is None:
+                from analyzer import MomentAnalyzer
+                from incremental import IncrementalAnalyzer
+                analyzer = MomentAnalyzer(
+                    clustering_backend=os.getenv("ANALYSIS_CLUSTERING_BACKEND", "auto"),
+                    window_size=int(os.getenv("ANALYSIS_WINDOW_SIZE", "1000"))
+                )
+                _incremental_analyzer = IncrementalAnalyzer(analyzer)
+                _analyzer = analyzer
+    return _analyzer
+
+def get_incremental_analyzer():
+    get_analyzer()
+    return _incremental_analyzer
+
+def warm_up_analyzer():
+    """Load the analyzer and run it once, so the first real analysis pays no setup cost"""
+    start_time = time.perf_counter()
+    notes = [dict(note, id=position) for position, note in enumerate(judge_demo.get_demo_notes()[:6], 1)]
+    get_analyzer().analyze_notes(notes)
+    print(f"Analyzer warmed up in {time.perf_counter() - start_time:.2f}s")
+
 demo_seeder = DemoDataSeeder()
 judge_demo = JudgeDemoData()
+# Built once; every demo account is copied from it
+demo_template = DemoTemplate(judge_demo.get_demo_notes(), judge_demo.get_precomputed_moments())
 security = HTTPBearer()
 
-# Create tables and demo data on startup
+# Create tables on startup; the rest follows without delaying requests
 @app.on_event("startup")
 def startup_event():
+    if ANALYZER_WARMUP not in ("off", "background", "eager"):
+        raise ValueError(f"Unknown ANALYZER_WARMUP '{ANALYZER_WARMUP}', expected off, background or eager")
     create_tables()
-    # Create persistent demo user and data
-    create_demo_data()
+    if ANALYZER_WARMUP == "eager":
+        warm_up_analyzer()
+    threading.Thread(target=finish_startup, name="startup", daemon=True).start()
+
+def finish_startup():
+    """Startup work that requests do not depend on"""
+    try:
+        migrate_images()
+        # Create persistent demo user and data
+        create_demo_data()
+        if ANALYZER_WARMUP == "background":
+            warm_up_analyzer()
+    except Exception as e:
+        print(f"Background startup failed: {e}")
+
+@app.on_event("startup")
+async def start_demo_reaper():
+    """Delete expired public demo accounts in the background"""
+    if REAPER_INTERVAL_SECONDS <= 0:
+        return
+    from database import SessionLocal
+    
+    def forget_users(user_ids):
+        if _incremental_analyzer is None:
+            return
+        for user_id in user_ids:
+            _incremental_analyzer.discard(user_id)
+    
+    app.state.demo_reaper = asyncio.create_task(
+        reap_periodically(SessionLocal, REAPER_INTERVAL_SECONDS, on_deleted=forget_users)
+    )
+
+def migrate_images():
+    """Move images still stored inline on notes into the image store"""
+    from database import SessionLocal
+    db = SessionLocal()
+    
+    try:
+        moved = migrate_inline_images(db)
+        if moved:
+            print(f"Moved {moved} inline note images to the image store")
+    finally:
+        db.close()
 
 def create_demo_data():
     """Create persistent demo user and data on startup"""
@@ -52,45 +183,11 @@ def create_demo_data():
             hashed_password = get_password_hash("demo123")
             demo_user = models.User(email="demo@echotrail.ai", hashed_password=hashed_password)
             db.add(demo_user)
-            db.commit()
-            db.refresh(demo_user)
-            
-            # Load demo notes
-            demo_notes = judge_demo.get_demo_notes()
-            
-            for note_data in demo_notes:
-                note = models.Note(
-                    title=note_data["title"],
-                    content=note_data["content"],
-                    mood=note_data["mood"],
-                    energy_level=note_data["energy_level"],
-                    created_at=note_data["created_at"],
-                    updated_at=note_data["created_at"],
-                    user_id=demo_user.id
-                )
-                db.add(note)
-            
-            # Load precomputed moments
-            precomputed_moments = judge_demo.get_precomputed_moments()
-            
-            for moment_data in precomputed_moments:
-                moment = models.Moment(
-                    title=moment_data['title'],
-                    summary=moment_data['summary'],
-                    emotional_tone=moment_data['emotional_tone'],
-                    emotional_score=moment_data['emotional_score'],
-                    keywords=json.dumps(moment_data['keywords']),
-                    reflection_prompt=moment_data['reflection_prompt'],
-                    start_date=datetime.fromisoformat(moment_data['start_date']),
-                    end_date=datetime.fromisoformat(moment_data['end_date']),
-                    note_count=moment_data['note_count'],
-                    note_ids=json.dumps(moment_data['note_ids']),
-                    user_id=demo_user.id
-                )
-                db.add(moment)
+            db.flush()
             
-            db.commit()
-            print(f"Demo data created: {len(demo_notes)} notes, {len(precomputed_moments)} moments")
+            # Load demo notes and precomputed moments in one transaction
+            notes_created, moments_created = demo_template.provision(db, demo_user.id)
+            print(f"Demo data created: {notes_created} notes, {moments_created} moments")
         else:
             print("Demo data already exists")
             
@@ -114,11 +211,23 @@ def demo_login():
 def health_check():
     return {"status": "healthy", "timestamp": datetime.utcnow(), "version": "1.0.1"}
 
+@app.get("/metrics", response_class=PlainTextResponse)
+def get_metrics():
+    """Analysis stage and request latency histograms in Prometheus text format"""
+    return render_metrics()
+
 # Authentication endpoints
 @app.post("/auth/register", response_model=schemas.Token)
-def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
+async def register(user_data: schemas.UserCreate, db: AsyncSession = Depends(get_async_db)):
+    # Public demo accounts are created, and reaped, in this namespace
+    if is_reserved_demo_email(user_data.email):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="This email address is reserved for demo accounts"
+        )
+    
     # Check if user exists
-    existing_user = db.query(models.User).filter(models.User.email == user_data.email).first()
+    existing_user = await db.scalar(select(models.User).where(models.User.email == user_data.email))
     if existing_user:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
@@ -129,16 +238,15 @@ def register(user_data: schemas.UserCreate, db: Session = Depends(get_db)):
     hashed_password = get_password_hash(user_data.password)
     user = models.User(email=user_data.email, hashed_password=hashed_password)
     db.add(user)
-    db.commit()
-    db.refresh(user)
+    await db.commit()
     
     # Create access token
     access_token = create_access_token(data={"sub": user.email})
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.post("/auth/login", response_model=schemas.Token)
-def login(user_data: schemas.UserLogin, db: Session = Depends(get_db)):
-    user = db.query(models.User).filter(models.User.email == user_data.email).first()
+async def login(user_data: schemas.UserLogin, db: AsyncSession = Depends(get_async_db)):
+    user = await db.scalar(select(models.User).where(models.User.email == user_data.email))
     if not user or not verify_password(user_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -149,226 +257,533 @@ def login(user_data: schemas.UserLogin, db: Session = Depends(get_db)):
     return {"access_token": access_token, "token_type": "bearer"}
 
 @app.get("/auth/me", response_model=schemas.User)
-def get_current_user_info(current_user: models.User = Depends(get_current_user)):
+async def get_current_user_info(current_user: CachedUser = Depends(get_current_user)):
     return current_user
 
 # Notes endpoints
 @app.post("/notes", response_model=schemas.Note)
-def create_note(
+async def create_note(
     note_data: schemas.NoteCreate,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
+    image_hashes = await db.run_sync(store_images, [note_data.image_data])
     note = models.Note(
         title=note_data.title,
         content=note_data.content,
         mood=note_data.mood,
         energy_level=note_data.energy_level,
-        image_data=note_data.image_data,
+        image_hash=image_hashes[0],
         user_id=current_user.id
     )
     db.add(note)
-    db.commit()
-    db.refresh(note)
+    await db.flush()
+    await db.refresh(note)
+    await db.run_sync(apply_note_deltas, current_user.id, [note_as_dict(note)])
+    await db.commit()
     return note
 
-@app.get("/notes")
-def get_notes(
+async def read_import_items(request: Request):
+    """Yield (index, item) from a JSON array body or an NDJSON stream read as it arrives
+    
+    Gzipped bodies (Content-Encoding: gzip or a gzip content type) are read
+    as NDJSON, the format GET /export produces.
+    """
+    content_type = request.headers.get("content-type", "")
+    gzipped = "gzip" in content_type or request.headers.get("content-encoding") == "gzip"
+    if not gzipped and "ndjson" not in content_type and "jsonl" not in content_type:
+        try:
+            items = json.loads(await request.body())
+        except ValueError:
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        if not isinstance(items, list):
+            raise HTTPException(status_code=400, detail="Body must be a JSON array or NDJSON")
+        for index, item in enumerate(items):
+            yield index, item
+        return
+    
+    chunks = gunzip_chunks(request.stream()) if gzipped else request.stream()
+    index = 0
+    buffer = b""
+    try:
+        async for chunk in chunks:
+            buffer += chunk
+            *lines, buffer = buffer.split(b"\n")
+            for line in lines:
+                if line.strip():
+                    yield index, line
+                    index += 1
+    except zlib.error:
+        raise HTTPException(status_code=400, detail="Body is not valid gzip")
+    if buffer.strip():
+        yield index, buffer
+
+def describe_import_error(e: ValueError) -> str:
+    # ValidationError is a ValueError, as is a malformed NDJSON line
+    if isinstance(e, ValidationError):
+        return "; ".join(f"{'.'.join(map(str, err['loc'])) or 'note'}: {err['msg']}" for err in e.errors())
+    return f"Invalid JSON: {e}"
+
+
+@app.post("/notes/bulk", response_model=schemas.BulkImportResponse)
+async def import_notes(
+    request: Request,
+    current_user: CachedUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Import many notes from a JSON array or NDJSON, one transaction per chunk"""
+    results = []
+    pending = []
+    
+    async def flush():
+        chunk = pending[:]
+        pending.clear()
+        try:
+            ids = await run_in_threadpool(insert_notes, db, current_user.id, [note for _, note in chunk])
+        except SQLAlchemyError as e:
+            await run_in_threadpool(db.rollback)
+            results.extend({"index": index, "status": "error", "error": str(e.__cause__ or e)} for index, _ in chunk)
+        else:
+            results.extend({"index": index, "status": "created", "id": note_id} for (index, _), note_id in zip(chunk, ids))
+    
+    async for index, item in read_import_items(request):
+        if index >= BULK_IMPORT_MAX_NOTES:
+            results.append({"index": index, "status": "error", "error": f"Import limit of {BULK_IMPORT_MAX_NOTES} notes reached"})
+            break
+        try:
+            if isinstance(item, bytes):
+                item = json.loads(item)
+            note = schemas.NoteImport.model_validate(item)
+        except ValueError as e:
+            results.append({"index": index, "status": "error", "error": describe_import_error(e)})
+            continue
+        
+        pending.append((index, note.model_dump()))
+        if len(pending) >= BULK_CHUNK_SIZE:
+            await flush()
+    
+    if pending:
+        await flush()
+    
+    results.sort(key=lambda result: result["index"])
+    created = sum(1 for result in results if result["status"] == "created")
+    return {"created": created, "failed": len(results) - created, "results": results}
+
+@app.get("/export")
+async def export_account(
+    compress: bool = False,
+    current_user: CachedUser = Depends(get_current_user)
+):
+    """Stream every note and moment as NDJSON, optionally gzipped, for POST /import elsewhere"""
+    lines = export_lines(current_user.id)
+    filename = f"echotrail-export-{datetime.utcnow():%Y%m%d}.ndjson"
+    if compress:
+        return StreamingResponse(
+            gzip_chunks(lines), media_type="application/gzip",
+            headers={"Content-Disposition": f'attachment; filename="{filename}.gz"'}
+        )
+    return StreamingResponse(
+        lines, media_type="application/x-ndjson",
+        headers={"Content-Disposition": f'attachment; filename="{filename}"'}
+    )
+
+@app.post("/import", response_model=schemas.AccountImportResponse)
+async def import_account(
+    request: Request,
+    current_user: CachedUser = Depends(get_current_user),
+    db: Session = Depends(get_db)
+):
+    """Add the notes and moments of a GET /export stream to this account, with new note ids"""
+    errors = []
+    note_ids = {}  # exported note id -> id here
+    pending_notes = []
+    pending_moments = []
+    counts = {"notes": 0, "moments": 0}
+    
+    def error(index, message):
+        errors.append({"index": index, "status": "error", "error": message})
+    
+    async def flush_notes():
+        chunk = pending_notes[:]
+        pending_notes.clear()
+        try:
+            ids = await run_in_threadpool(insert_notes, db, current_user.id, [note for _, _, note in chunk])
+        except SQLAlchemyError as e:
+            await run_in_threadpool(db.rollback)
+            for index, _, _ in chunk:
+                error(index, str(e.__cause__ or e))
+        else:
+            note_ids.update((exported_id, note_id) for (_, exported_id, _), note_id in zip(chunk, ids))
+            counts["notes"] += len(ids)
+    
+    async def flush_moments():
+        chunk = []
+        for index, moment in pending_moments:
+            # Notes that failed to import drop out of their moments
+            moment["note_ids"] = [note_ids[note_id] for note_id in moment["note_ids"] if note_id in note_ids]
+            moment["note_count"] = len(moment["note_ids"])
+            if moment["note_ids"]:
+                chunk.append((index, moment))
+            else:
+                error(index, "None of the moment's notes were imported")
+        pending_moments.clear()
+        if not chunk:
+            return
+        try:
+            await run_in_threadpool(insert_moments, db, current_user.id, [moment for _, moment in chunk])
+        except SQLAlchemyError as e:
+            await run_in_threadpool(db.rollback)
+            for index, _ in chunk:
+                error(index, str(e.__cause__ or e))
+        else:
+            counts["moments"] += len(chunk)
+    
+    async for index, item in read_import_items(request):
+        try:
+            record = json.loads(item) if isinstance(item, bytes) else item
+            record_type = record.get("type") if isinstance(record, dict) else None
+            if record_type == "note":
+                if counts["notes"] + len(pending_notes) >= BULK_IMPORT_MAX_NOTES:
+                    error(index, f"Import limit of {BULK_IMPORT_MAX_NOTES} notes reached")
+                    break
+                note = schemas.NoteImport.model_validate(record)
+                pending_notes.append((index, record.get("id"), note.model_dump()))
+            elif record_type == "moment":
+                moment = schemas.MomentImport.model_validate(record)
+                pending_moments.append((index, moment.model_dump()))
+            elif record_type == "export":
+                if record.get("version") != EXPORT_FORMAT_VERSION:
+                    raise HTTPException(status_code=400, detail=f"Unsupported export version {record.get('version')!r}")
+            else:
+                error(index, f"Unknown record type {record_type!r}")
+        except ValueError as e:
+            error(index, describe_import_error(e))
+            continue
+        
+        if len(pending_notes) >= BULK_CHUNK_SIZE:
+            await flush_notes()
+        if pending_moments and (pending_notes or len(pending_moments) >= BULK_CHUNK_SIZE):
+            # Moments may only refer to notes that are already in
+            if pending_notes:
+                await flush_notes()
+            await flush_moments()
+    
+    if pending_notes:
+        await flush_notes()
+    if pending_moments:
+        await flush_moments()
+    
+    errors.sort(key=lambda result: result["index"])
+    return {
+        "notes_created": counts["notes"],
+        "moments_created": counts["moments"],
+        "failed": len(errors),
+        "errors": errors
+    }
+
+@app.get("/images/{image_hash}")
+async def get_image(image_hash: str, request: Request, db: AsyncSession = Depends(get_async_db)):
+    """Image bytes by content hash - the URL never changes meaning, so clients may cache forever
+
+    There is no auth check: the URL is a capability. The sha256 of the bytes
+    cannot be guessed without the image, so only clients that were given a
+    note's image_url can fetch it. An image is deleted with the last note
+    that refers to it, after which the URL returns 404.
+    """
+    etag = f'"{image_hash}"'
+    headers = {"ETag": etag, "Cache-Control": IMAGE_CACHE_CONTROL}
+    if request.headers.get("if-none-match") == etag:
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+    
+    image = await db.scalar(select(models.Image).where(models.Image.content_hash == image_hash))
+    if not image:
+        raise HTTPException(status_code=404, detail="Image not found")
+    return Response(content=image.data, media_type=image.content_type, headers=headers)
+
+@app.get("/notes", response_model=List[schemas.NoteSummary])
+async def get_notes(
+    response: Response,
     skip: int = 0,
     limit: int = 100,
+    cursor: str = None,
     search: str = None,
     mood: str = None,
     start_date: datetime = None,
     end_date: datetime = None,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    query = db.query(models.Note).filter(models.Note.user_id == current_user.id)
-    
-    if search:
-        query = query.filter(
-            (models.Note.title.contains(search)) | (models.Note.content.contains(search))
-        )
+    """Newest notes first; follow the X-Next-Cursor header for the next page"""
+    limit = clamp_limit(limit)
+    # Image bytes live in the images table; lists only carry image_url
+    query = select(models.Note).options(defer(models.Note.image_data)).where(
+        models.Note.user_id == current_user.id
+    )
     
     if mood:
-        query = query.filter(models.Note.mood == mood)
+        query = query.where(models.Note.mood == mood)
     
     if start_date:
-        query = query.filter(models.Note.created_at >= start_date)
+        query = query.where(models.Note.created_at >= start_date)
     
     if end_date:
-        query = query.filter(models.Note.created_at <= end_date)
+        query = query.where(models.Note.created_at <= end_date)
+    
+    if search:
+        # Full-text index with prefix matching, best matches first - ranked
+        # results are paged with skip rather than a date cursor
+        query = search_notes(db, query, search)
+        return (await db.scalars(query.order_by(models.Note.created_at.desc()).offset(skip).limit(limit))).all()
+    
+    if skip and not cursor:
+        query = query.order_by(models.Note.created_at.desc(), models.Note.id.desc()).offset(skip).limit(limit)
+        return (await db.scalars(query)).all()
+    
+    try:
+        notes, next_cursor = await keyset_page_async(db, query, models.Note.created_at, models.Note.id, limit, cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
     
-    notes = query.order_by(models.Note.created_at.desc()).offset(skip).limit(limit).all()
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
     return notes
 
 @app.delete("/notes/{note_id}")
-def delete_note(
+async def delete_note(
     note_id: int,
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    note = db.query(models.Note).filter(
+    note = await db.scalar(select(models.Note).where(
         models.Note.id == note_id,
         models.Note.user_id == current_user.id
-    ).first()
+    ))
     
     if not note:
         raise HTTPException(status_code=404, detail="Note not found")
     
-    db.delete(note)
-    db.commit()
+    await db.run_sync(apply_note_deltas, current_user.id, [note_as_dict(note)], -1)
+    await db.delete(note)
+    await db.flush()
+    # Its image stays reachable by URL until no note uses it
+    await db.run_sync(delete_unreferenced_images, [note.image_hash])
+    await db.commit()
     return {"message": "Note deleted successfully"}
 
 # Analysis endpoints
+def load_analysis_notes(db: Session, user_id: int):
+    """A user's notes in the dict format the analyzer expects, oldest first"""
+    query = db.query(models.Note).filter(models.Note.user_id == user_id)
+    notes = query.order_by(models.Note.created_at).all()
+    
+    # Convert to dict format for analyzer
+    notes_data = []
+    for note in notes:
+        notes_data.append({
+            'id': note.id,
+            'title': note.title,
+            'content': note.content,
+            'mood': note.mood,
+            'energy_level': note.energy_level,
+            'created_at': note.created_at,
+            'updated_at': note.updated_at
+        })
+    return notes_data
+
+def save_moments(db: Session, user_id: int, moments_data):
+    """Replace a user's stored moments with freshly analyzed ones"""
+    db.query(models.Moment).filter(models.Moment.user_id == user_id).delete(synchronize_session=False)
+    insert_moments(db, user_id, moments_data)
+
 @app.post("/analyze")
 def analyze_moments(
     request: schemas.AnalysisRequest,
-    current_user: models.User = Depends(get_current_user),
+    current_user: CachedUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     start_time = time.time()
+    timer = StageTimer()
     
     # Get notes for analysis
-    query = db.query(models.Note).filter(models.Note.user_id == current_user.id)
-    notes = query.order_by(models.Note.created_at).all()
+    notes_data = load_analysis_notes(db, current_user.id)
     
-    if not notes:
+    if not notes_data:
         return {
             "moments": [],
             "total_notes_analyzed": 0,
-            "analysis_time": time.time() - start_time
+            "analysis_time": time.time() - start_time,
+            "cache_hit": False,
+            "timings": timer.timings if request.include_timings else None
         }
     
-    # Convert to dict format for analyzer
-    notes_data = []
-    for note in notes:
-        notes_data.append({
-            'id': note.id,
-            'title': note.title,
-            'content': note.content,
-            'mood': note.mood,
-            'energy_level': note.energy_level,
-            'created_at': note.created_at
-        })
-    
-    # Run analysis
-    moments_data = analyzer.analyze_notes(notes_data, min_cluster_size=2)
+    # Reuse a previous analysis of exactly these notes when possible
+    analysis_params = {'min_cluster_size': 2, 'incremental': bool(request.incremental)}
+    notes_hash = hash_notes(notes_data, analysis_params)
+    moments_data = get_cached_analysis(db, notes_hash)
+    cache_hit = moments_data is not None
+    
+    if not cache_hit:
+        # Read stored per-note polarities and score only new or edited notes
+        with timer.stage('sentiment'):
+            attach_polarities(db, notes_data, get_analyzer())
+    
+    if not cache_hit and request.incremental:
+        # Only re-cluster notes added, edited or deleted since the last run
+        moments_data = get_incremental_analyzer().analyze_notes(
+            current_user.id, notes_data, min_cluster_size=analysis_params['min_cluster_size'], timer=timer
+        )
+    elif not cache_hit:
+        moments_data = get_analyzer().analyze_notes(
+            notes_data, min_cluster_size=analysis_params['min_cluster_size'], timer=timer
+        )
     
     # Save moments to database
-    db.query(models.Moment).filter(models.Moment.user_id == current_user.id).delete()
-    
-    for moment_data in moments_data:
-        moment = models.Moment(
-            title=moment_data['title'],
-            summary=moment_data['summary'],
-            emotional_tone=moment_data['emotional_tone'],
-            emotional_score=moment_data['emotional_score'],
-            keywords=json.dumps(moment_data['keywords']),
-            reflection_prompt=moment_data['reflection_prompt'],
-            start_date=moment_data['start_date'],
-            end_date=moment_data['end_date'],
-            note_count=moment_data['note_count'],
-            note_ids=json.dumps(moment_data['note_ids']),
-            user_id=current_user.id
-        )
-        db.add(moment)
+    with timer.stage('persist'):
+        save_moments(db, current_user.id, moments_data)
+        
+        if not cache_hit:
+            store_analysis(db, notes_hash, current_user.id, moments_data)
     
-    db.commit()
+    record_stage_timings(timer.timings)
     
     return {
         "moments": moments_data,
-        "total_notes_analyzed": len(notes),
-        "analysis_time": time.time() - start_time
+        "total_notes_analyzed": len(notes_data),
+        "analysis_time": time.time() - start_time,
+        "cache_hit": cache_hit,
+        "timings": timer.timings if request.include_timings else None
     }
 
-@app.get("/moments")
-def get_moments(
-    current_user: models.User = Depends(get_current_user),
+def persist_job_result(job, moments_data, new_scores):
+    """Write a finished background analysis back to the database"""
+    from database import SessionLocal
+    db = SessionLocal()
+    
+    try:
+        store_polarities(db, new_scores)
+        save_moments(db, job.user_id, moments_data)
+        store_analysis(db, job.notes_hash, job.user_id, moments_data)
+    finally:
+        db.close()
+
+analysis_jobs = AnalysisJobManager(
+    persist_job_result,
+    analyzer_options={
+        'clustering_backend': os.getenv("ANALYSIS_CLUSTERING_BACKEND", "auto"),
+        'window_size': int(os.getenv("ANALYSIS_WINDOW_SIZE", "1000"))
+    }
+)
+
+@app.on_event("shutdown")
+def shutdown_event():
+    analysis_jobs.shutdown()
+
+@app.on_event("shutdown")
+async def stop_demo_reaper():
+    task = getattr(app.state, "demo_reaper", None)
+    if task is not None:
+        task.cancel()
+
+@app.on_event("shutdown")
+async def close_async_engine():
+    # Each pooled aiosqlite connection keeps a worker thread alive until closed
+    await async_engine.dispose()
+
+@app.post("/analyze/jobs", status_code=status.HTTP_202_ACCEPTED)
+def start_analysis_job(
+    request: schemas.AnalysisRequest,
+    current_user: CachedUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    moments = db.query(models.Moment).filter(
-        models.Moment.user_id == current_user.id
-    ).order_by(models.Moment.start_date.desc()).all()
-    
-    # Convert to response format
-    response_moments = []
-    for moment in moments:
-        response_moments.append({
-            "id": moment.id,
-            "title": moment.title,
-            "summary": moment.summary,
-            "emotional_tone": moment.emotional_tone,
-            "emotional_score": moment.emotional_score,
-            "keywords": json.loads(moment.keywords),
-            "reflection_prompt": moment.reflection_prompt,
-            "start_date": moment.start_date.isoformat(),
-            "end_date": moment.end_date.isoformat(),
-            "note_count": moment.note_count,
-            "note_ids": json.loads(moment.note_ids),
-            "created_at": moment.created_at.isoformat()
-        })
+    """Start a background analysis, or join the one already running for the same notes"""
+    notes_data = load_analysis_notes(db, current_user.id)
+    
+    # Background jobs always run a full analysis in a worker process
+    analysis_params = {'min_cluster_size': 2, 'incremental': False}
+    notes_hash = hash_notes(notes_data, analysis_params)
+    
+    job = analysis_jobs.find_active(current_user.id, notes_hash)
+    if job is not None:
+        return job.to_dict()
+    
+    if not notes_data:
+        return analysis_jobs.add_finished(current_user.id, notes_hash, []).to_dict()
+    
+    moments_data = get_cached_analysis(db, notes_hash)
+    if moments_data is not None:
+        save_moments(db, current_user.id, moments_data)
+        return analysis_jobs.add_finished(current_user.id, notes_hash, moments_data, cache_hit=True).to_dict()
+    
+    # Only stored polarities travel to the worker; it scores the rest
+    load_polarities(db, notes_data)
+    job = analysis_jobs.submit(
+        current_user.id, notes_hash, notes_data, analysis_params['min_cluster_size']
+    )
+    return job.to_dict()
+
+@app.get("/analyze/jobs/{job_id}")
+def get_analysis_job(
+    job_id: str,
+    current_user: CachedUser = Depends(get_current_user)
+):
+    job = analysis_jobs.get(job_id)
+    if job is None or job.user_id != current_user.id:
+        raise HTTPException(status_code=404, detail="Analysis job not found")
+    return job.to_dict()
+
+def moment_to_dict(moment: models.Moment):
+    return {
+        "id": moment.id,
+        "title": moment.title,
+        "summary": moment.summary,
+        "emotional_tone": moment.emotional_tone,
+        "emotional_score": moment.emotional_score,
+        "keywords": json.loads(moment.keywords),
+        "reflection_prompt": moment.reflection_prompt,
+        "start_date": moment.start_date.isoformat(),
+        "end_date": moment.end_date.isoformat(),
+        "note_count": moment.note_count,
+        "note_ids": json.loads(moment.note_ids),
+        "created_at": moment.created_at.isoformat()
+    }
+
+@app.get("/moments")
+async def get_moments(
+    response: Response,
+    limit: int = None,
+    cursor: str = None,
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
+):
+    """Latest moments first; all of them unless a limit or cursor asks for pages"""
+    query = select(models.Moment).where(models.Moment.user_id == current_user.id)
     
-    return response_moments
+    if limit is None and cursor is None:
+        moments = await db.scalars(query.order_by(models.Moment.start_date.desc(), models.Moment.id.desc()))
+        return [moment_to_dict(moment) for moment in moments]
+    
+    try:
+        moments, next_cursor = await keyset_page_async(
+            db, query, models.Moment.start_date, models.Moment.id, clamp_limit(limit or 100), cursor
+        )
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    
+    if next_cursor:
+        response.headers[NEXT_CURSOR_HEADER] = next_cursor
+    return [moment_to_dict(moment) for moment in moments]
 
 # Public Demo endpoint (no auth required)
 @app.post("/demo/public")
 def load_public_demo(db: Session = Depends(get_db)):
     """Load demo data for public access without authentication"""
-    # Create a temporary demo user
-    demo_email = f"public-demo-{int(datetime.utcnow().timestamp())}@echotrail.ai"
-    hashed_password = get_password_hash("demo123")
-    
-    # Check if user already exists
-    existing_user = db.query(models.User).filter(models.User.email == demo_email).first()
-    if existing_user:
-        user = existing_user
-    else:
-        user = models.User(email=demo_email, hashed_password=hashed_password)
-        db.add(user)
-        db.commit()
-        db.refresh(user)
-    
-    # Clear existing data for this user
-    db.query(models.Note).filter(models.Note.user_id == user.id).delete()
-    db.query(models.Moment).filter(models.Moment.user_id == user.id).delete()
-    db.commit()
-    
-    # Load demo notes
-    demo_notes = judge_demo.get_demo_notes()
-    
-    for note_data in demo_notes:
-        note = models.Note(
-            title=note_data["title"],
-            content=note_data["content"],
-            mood=note_data["mood"],
-            energy_level=note_data["energy_level"],
-            created_at=note_data["created_at"],
-            updated_at=note_data["created_at"],
-            user_id=user.id
-        )
-        db.add(note)
-    
-    # Load precomputed moments
-    precomputed_moments = judge_demo.get_precomputed_moments()
-    
-    for moment_data in precomputed_moments:
-        moment = models.Moment(
-            title=moment_data['title'],
-            summary=moment_data['summary'],
-            emotional_tone=moment_data['emotional_tone'],
-            emotional_score=moment_data['emotional_score'],
-            keywords=json.dumps(moment_data['keywords']),
-            reflection_prompt=moment_data['reflection_prompt'],
-            start_date=datetime.fromisoformat(moment_data['start_date']),
-            end_date=datetime.fromisoformat(moment_data['end_date']),
-            note_count=moment_data['note_count'],
-            note_ids=json.dumps(moment_data['note_ids']),
-            user_id=user.id
-        )
-        db.add(moment)
+    # Create a temporary demo user, unique per visitor
+    user = models.User(email=public_demo_email(), hashed_password=get_password_hash("demo123"), is_demo=True)
+    db.add(user)
+    db.flush()
     
-    db.commit()
+    # Copy the demo notes and precomputed moments from the template
+    notes_created, moments_created = demo_template.provision(db, user.id)
     
     # Create access token for this user
     access_token = create_access_token(data={"sub": user.email})
@@ -377,69 +792,30 @@ def load_public_demo(db: Session = Depends(get_db)):
         "success": True,
         "access_token": access_token,
         "token_type": "bearer",
-        "notes_created": len(demo_notes),
-        "moments_created": len(precomputed_moments),
+        "notes_created": notes_created,
+        "moments_created": moments_created,
         "demo_mode": True
     }
 
 # Judge Demo Mode endpoint
 @app.post("/demo/judge")
 def load_judge_demo(
-    current_user: models.User = Depends(get_current_user),
+    current_user: CachedUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
     """Load deterministic demo data designed for judge evaluation"""
     start_time = time.time()
     
-    # Clear existing data
-    db.query(models.Note).filter(models.Note.user_id == current_user.id).delete()
-    db.query(models.Moment).filter(models.Moment.user_id == current_user.id).delete()
-    db.commit()
-    
-    # Load judge demo notes
-    demo_notes = judge_demo.get_demo_notes()
-    
-    # Save notes to database
-    for note_data in demo_notes:
-        note = models.Note(
-            title=note_data["title"],
-            content=note_data["content"],
-            mood=note_data["mood"],
-            energy_level=note_data["energy_level"],
-            created_at=note_data["created_at"],
-            updated_at=note_data["created_at"],
-            user_id=current_user.id
-        )
-        db.add(note)
-    
-    db.commit()
-    
-    # Load precomputed moments for deterministic results
-    precomputed_moments = judge_demo.get_precomputed_moments()
-    
-    for moment_data in precomputed_moments:
-        moment = models.Moment(
-            title=moment_data['title'],
-            summary=moment_data['summary'],
-            emotional_tone=moment_data['emotional_tone'],
-            emotional_score=moment_data['emotional_score'],
-            keywords=json.dumps(moment_data['keywords']),
-            reflection_prompt=moment_data['reflection_prompt'],
-            start_date=datetime.fromisoformat(moment_data['start_date']),
-            end_date=datetime.fromisoformat(moment_data['end_date']),
-            note_count=moment_data['note_count'],
-            note_ids=json.dumps(moment_data['note_ids']),
-            user_id=current_user.id
-        )
-        db.add(moment)
-    
-    db.commit()
+    # Replace existing data with the judge demo notes and precomputed moments
+    # for deterministic results
+    clear_user_data(db, current_user.id)
+    notes_created, moments_created = demo_template.provision(db, current_user.id)
     
     return {
         "success": True,
         "message": "Judge demo data loaded successfully",
-        "notes_created": len(demo_notes),
-        "moments_created": len(precomputed_moments),
+        "notes_created": notes_created,
+        "moments_created": moments_created,
         "load_time": time.time() - start_time,
         "standout_moment": "A Period of Transition",
         "demo_mode": True
@@ -448,32 +824,13 @@ def load_judge_demo(
 # Demo data endpoints
 @app.post("/demo/seed")
 def seed_demo_data(
-    current_user: models.User = Depends(get_current_user),
+    current_user: CachedUser = Depends(get_current_user),
     db: Session = Depends(get_db)
 ):
-    # Clear existing notes
-    db.query(models.Note).filter(models.Note.user_id == current_user.id).delete()
-    db.query(models.Moment).filter(models.Moment.user_id == current_user.id).delete()
-    db.commit()
-    
-    # Generate demo notes
+    # Replace existing notes with generated demo notes
+    clear_user_data(db, current_user.id)
     demo_notes = demo_seeder.generate_demo_notes(current_user.id)
-    
-    # Save to database
-    for note_data in demo_notes:
-        note = models.Note(
-            title=note_data["title"],
-            content=note_data["content"],
-            mood=note_data["mood"],
-            energy_level=note_data["energy_level"],
-            image_data=note_data["image_data"],
-            created_at=note_data["created_at"],
-            updated_at=note_data["updated_at"],
-            user_id=current_user.id
-        )
-        db.add(note)
-    
-    db.commit()
+    insert_demo_dataset(db, current_user.id, demo_notes)
     
     return {
         "message": "Demo data seeded successfully",
@@ -483,58 +840,13 @@ def seed_demo_data(
 
 # Insights endpoints
 @app.get("/insights/stats")
-def get_insights_stats(
-    current_user: models.User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def get_insights_stats(
+    start_date: datetime = None,
+    end_date: datetime = None,
+    current_user: CachedUser = Depends(get_current_user),
+    db: AsyncSession = Depends(get_async_db)
 ):
-    notes = db.query(models.Note).filter(models.Note.user_id == current_user.id).all()
-    moments = db.query(models.Moment).filter(models.Moment.user_id == current_user.id).all()
-    
-    if not notes:
-        return {
-            "total_notes": 0,
-            "total_moments": 0,
-            "mood_distribution": {},
-            "energy_trends": [],
-            "recent_activity": 0
-        }
-    
-    # Mood distribution
-    mood_counts = {}
-    energy_by_date = {}
-    
-    for note in notes:
-        mood_counts[note.mood] = mood_counts.get(note.mood, 0) + 1
-        date_key = note.created_at.date().isoformat()
-        if date_key not in energy_by_date:
-            energy_by_date[date_key] = []
-        energy_by_date[date_key].append(note.energy_level)
-    
-    # Energy trends (daily averages)
-    energy_trends = []
-    for date_str, energy_levels in sorted(energy_by_date.items()):
-        avg_energy = sum(energy_levels) / len(energy_levels)
-        energy_trends.append({
-            "date": date_str,
-            "average_energy": round(avg_energy, 1),
-            "note_count": len(energy_levels)
-        })
-    
-    # Recent activity (last 7 days)
-    recent_cutoff = datetime.utcnow() - timedelta(days=7)
-    recent_notes = [n for n in notes if n.created_at >= recent_cutoff]
-    
-    return {
-        "total_notes": len(notes),
-        "total_moments": len(moments),
-        "mood_distribution": mood_counts,
-        "energy_trends": energy_trends[-30:],  # Last 30 days
-        "recent_activity": len(recent_notes),
-        "date_range": {
-            "start": min(n.created_at for n in notes).isoformat() if notes else None,
-            "end": max(n.created_at for n in notes).isoformat() if notes else None
-        }
-    }
+    return await db.run_sync(insights_stats, current_user.id, start_date, end_date)
 
 if __name__ == "__main__":
     import uvicorn
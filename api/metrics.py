@@ -0,0 +1,98 @@
+"""
+Lightweight metrics - per-stage analysis timers and latency histograms
+rendered in the Prometheus text exposition format
+"""
+from contextlib import contextmanager
+from typing import Dict, Tuple, Iterable
+import threading
+import time
+
+# Seconds; covers fast cached requests through multi-minute analyses
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0, 120.0, 300.0)
+
+def _escape(value: str) -> str:
+    return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+class StageTimer:
+    """Accumulates seconds spent per pipeline stage during one call
+
+    Nested stages are not double counted: time spent in an inner stage is
+    subtracted from the stage around it, so the stages add up to the total.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self._nested = []
+
+    @contextmanager
+    def stage(self, name: str):
+        start = time.perf_counter()
+        self._nested.append(0.0)
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            inner = self._nested.pop()
+            self.timings[name] = self.timings.get(name, 0.0) + elapsed - inner
+            if self._nested:
+                self._nested[-1] += elapsed
+
+class Histogram:
+    """Cumulative-bucket histogram keyed by label values, safe to share across threads"""
+
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...], buckets: Iterable[float] = DEFAULT_BUCKETS):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._series = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels[name]) for name in self.labelnames)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                series = self._series[key] = {'buckets': [0] * len(self.buckets), 'count': 0, 'sum': 0.0}
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    series['buckets'][i] += 1
+            series['count'] += 1
+            series['sum'] += value
+
+    def _labels(self, key: Tuple[str, ...], extra: Dict[str, str] = None) -> str:
+        pairs = list(zip(self.labelnames, key)) + list((extra or {}).items())
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in pairs) + "}"
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            for key, series in sorted(self._series.items()):
+                for bound, count in zip(self.buckets, series['buckets']):
+                    lines.append(f"{self.name}_bucket{self._labels(key, {'le': repr(float(bound))})} {count}")
+                lines.append(f"{self.name}_bucket{self._labels(key, {'le': '+Inf'})} {series['count']}")
+                lines.append(f"{self.name}_sum{self._labels(key)} {series['sum']}")
+                lines.append(f"{self.name}_count{self._labels(key)} {series['count']}")
+        return "\n".join(lines) + "\n"
+
+ANALYSIS_STAGE_SECONDS = Histogram(
+    "echotrail_analysis_stage_seconds",
+    "Time spent in each stage of the moment analysis pipeline",
+    ("stage",)
+)
+
+REQUEST_SECONDS = Histogram(
+    "echotrail_http_request_duration_seconds",
+    "HTTP request latency by route",
+    ("method", "route", "status")
+)
+
+def record_stage_timings(timings: Dict[str, float]):
+    for stage, seconds in timings.items():
+        ANALYSIS_STAGE_SECONDS.observe(seconds, stage=stage)
+
+def render_metrics() -> str:
+    """All metrics in the Prometheus text exposition format"""
+    return "".join(histogram.render() for histogram in (ANALYSIS_STAGE_SECONDS, REQUEST_SECONDS))
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, Integer, String, Text, DateTime, Float, ForeignKey, Boolean
+from sqlalchemy import Column, Integer, String, Text, Date, DateTime, Float, ForeignKey, Boolean, Index, LargeBinary, UniqueConstraint
 from sqlalchemy.ext.declarative import declarative_base
 from sqlalchemy.orm import relationship
 from datetime import datetime
@@ -12,6 +12,7 @@ class User(Base):
     email = Column(String, unique=True, index=True)
     hashed_password = Column(String)
     created_at = Column(DateTime, default=datetime.utcnow)
+    is_demo = Column(Boolean, default=False, index=True)  # public demo visitor, reaped once expired
     
     notes = relationship("Note", back_populates="owner")
 
@@ -23,12 +24,40 @@ class Note(Base):
     content = Column(Text)
     mood = Column(String)  # emoji
     energy_level = Column(Integer, default=3)  # 1-5
-    image_data = Column(Text, nullable=True)  # base64 encoded
+    image_data = Column(Text, nullable=True)  # legacy inline base64, moved to images on startup
+    image_hash = Column(String, nullable=True, index=True)  # content hash of the image in images
     created_at = Column(DateTime, default=datetime.utcnow)
     updated_at = Column(DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
     
     user_id = Column(Integer, ForeignKey("users.id"))
     owner = relationship("User", back_populates="notes")
+    
+    @property
+    def image_url(self):
+        return f"/images/{self.image_hash}" if self.image_hash else None
+    
+    __table_args__ = (
+        # Newest-first keyset pages per user
+        Index("ix_notes_user_created_id", "user_id", "created_at", "id"),
+    )
+
+class Image(Base):
+    __tablename__ = "images"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String, unique=True, index=True)  # sha256 of the bytes
+    content_type = Column(String)
+    size = Column(Integer)
+    data = Column(LargeBinary)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+class NoteSentiment(Base):
+    __tablename__ = "note_sentiments"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    content_hash = Column(String, unique=True, index=True)  # hash of note title + content
+    polarity = Column(Float)  # -1 to 1
+    created_at = Column(DateTime, default=datetime.utcnow)
 
 class Moment(Base):
     __tablename__ = "moments"
@@ -47,6 +76,10 @@ class Moment(Base):
     created_at = Column(DateTime, default=datetime.utcnow)
     
     user_id = Column(Integer, ForeignKey("users.id"))
+    
+    __table_args__ = (
+        Index("ix_moments_user_start_id", "user_id", "start_date", "id"),
+    )
 
 class AnalysisCache(Base):
     __tablename__ = "analysis_cache"
@@ -54,4 +87,22 @@ class AnalysisCache(Base):
     id = Column(Integer, primary_key=True, index=True)
     notes_hash = Column(String, unique=True, index=True)
     result = Column(Text)  # JSON string
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    created_at = Column(DateTime, default=datetime.utcnow)
+    last_accessed_at = Column(DateTime, default=datetime.utcnow)
+    
+    user_id = Column(Integer, ForeignKey("users.id"), index=True)
+
+class DailyNoteStats(Base):
+    __tablename__ = "daily_note_stats"
+    
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"))
+    day = Column(Date)  # UTC day of note creation
+    mood = Column(String)  # emoji, "" for notes without one
+    note_count = Column(Integer, default=0)
+    energy_sum = Column(Integer, default=0)
+    energy_count = Column(Integer, default=0)  # notes with an energy level
+    
+    __table_args__ = (
+        UniqueConstraint("user_id", "day", "mood", name="uq_daily_note_stats_user_day_mood"),
+    )
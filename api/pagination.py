@@ -0,0 +1,67 @@
+"""
+Keyset pagination - newest-first pages that seek past the last row seen
+instead of counting through OFFSET rows
+"""
+from datetime import datetime
+from typing import Optional, Tuple, List
+import base64
+import json
+
+from sqlalchemy import Select, and_, or_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Query
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+MAX_PAGE_SIZE = 500
+
+def clamp_limit(limit: int) -> int:
+    """Page size between 1 and MAX_PAGE_SIZE - larger requests get a full page instead of an error"""
+    return max(1, min(limit, MAX_PAGE_SIZE))
+
+def encode_cursor(sort_value: datetime, row_id: int) -> str:
+    """Opaque cursor for the position just after a row"""
+    payload = json.dumps([sort_value.isoformat(), row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(payload.encode()).decode().rstrip("=")
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """Position encoded by encode_cursor; raises ValueError for anything else"""
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        sort_value, row_id = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        return datetime.fromisoformat(sort_value), int(row_id)
+    except (TypeError, ValueError, UnicodeDecodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor!r}") from e
+
+def _page_query(query, sort_column, id_column, limit: int, cursor: Optional[str]):
+    if cursor:
+        sort_value, row_id = decode_cursor(cursor)
+        query = query.filter(or_(
+            sort_column < sort_value,
+            and_(sort_column == sort_value, id_column < row_id)
+        ))
+
+    # One extra row tells whether another page follows
+    return query.order_by(sort_column.desc(), id_column.desc()).limit(limit + 1)
+
+def _split_page(rows: List, sort_column, id_column, limit: int) -> Tuple[List, Optional[str]]:
+    if len(rows) <= limit:
+        return rows, None
+
+    rows = rows[:limit]
+    last = rows[-1]
+    return rows, encode_cursor(getattr(last, sort_column.key), getattr(last, id_column.key))
+
+def keyset_page(query: Query, sort_column, id_column, limit: int, cursor: Optional[str] = None) -> Tuple[List, Optional[str]]:
+    """One page of query ordered by (sort_column, id_column) descending, plus the next cursor
+
+    Served from a (user_id, sort_column, id) index, so every page costs the
+    same however deep into the history it is.
+    """
+    rows = _page_query(query, sort_column, id_column, limit, cursor).all()
+    return _split_page(rows, sort_column, id_column, limit)
+
+async def keyset_page_async(db: AsyncSession, statement: Select, sort_column, id_column, limit: int,
+                            cursor: Optional[str] = None) -> Tuple[List, Optional[str]]:
+    """keyset_page for a select() of one entity run on an async session"""
+    rows = (await db.scalars(_page_query(statement, sort_column, id_column, limit, cursor))).all()
+    return _split_page(rows, sort_column, id_column, limit)
@@ -0,0 +1,151 @@
+"""
+Demo reaper - deletes public demo accounts older than a configurable age,
+with everything they own, in batched transactions, then returns the freed
+pages to the filesystem
+
+Usage:
+    python reaper.py [--max-age-hours 24] [--vacuum incremental|full|off]
+"""
+from collections import Counter
+from datetime import datetime, timedelta
+from typing import Callable, Dict, Any, List, Optional
+import argparse
+import asyncio
+import os
+import time
+
+from sqlalchemy import select, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.orm import Session
+
+import models
+from user_cache import invalidate_user
+
+DEMO_USER_MAX_AGE_HOURS = float(os.getenv("DEMO_USER_MAX_AGE_HOURS", "24"))
+# Seconds between background runs; 0 turns the background reaper off
+REAPER_INTERVAL_SECONDS = float(os.getenv("REAPER_INTERVAL_SECONDS", "3600"))
+# Users deleted per transaction, so writers never wait long on the reaper
+REAPER_BATCH_SIZE = int(os.getenv("REAPER_BATCH_SIZE", "100"))
+# incremental: release free pages if the database uses auto_vacuum=INCREMENTAL
+# full: rebuild the whole file with VACUUM; off: leave free pages for reuse
+REAPER_VACUUM = os.getenv("REAPER_VACUUM", "incremental")
+
+# Tables whose rows belong to a user, deleted before the users themselves
+USER_OWNED = [models.Note, models.Moment, models.AnalysisCache, models.DailyNoteStats]
+
+def _database_size(engine: Engine) -> Optional[int]:
+    if engine.dialect.name != "sqlite":
+        return None
+    with engine.connect() as conn:
+        page_count = conn.execute(text("PRAGMA page_count")).scalar()
+        page_size = conn.execute(text("PRAGMA page_size")).scalar()
+    return page_count * page_size
+
+def vacuum(engine: Engine, mode: str = REAPER_VACUUM) -> Optional[int]:
+    """Shrink an SQLite file after deletes; returns bytes reclaimed, None where it does not apply"""
+    if mode not in ("incremental", "full", "off"):
+        raise ValueError(f"Unknown vacuum mode '{mode}', expected incremental, full or off")
+    before = _database_size(engine)
+    if before is None or mode == "off":
+        return None
+
+    # VACUUM cannot run inside a transaction
+    with engine.connect() as conn:
+        conn = conn.execution_options(isolation_level="AUTOCOMMIT")
+        if mode == "full":
+            conn.execute(text("VACUUM"))
+        elif conn.execute(text("PRAGMA auto_vacuum")).scalar() == 2:
+            # Frees one page per step; executescript steps it to completion
+            conn.connection.dbapi_connection.executescript("PRAGMA incremental_vacuum")
+        # In WAL mode the file only shrinks once the log is written back
+        conn.execute(text("PRAGMA wal_checkpoint(TRUNCATE)")).fetchall()
+    return before - _database_size(engine)
+
+def delete_orphaned_images(db: Session, cutoff: datetime) -> int:
+    """Delete images no note refers to, skipping recent ones a pending note may be about to use"""
+    referenced = select(models.Note.image_hash).where(models.Note.image_hash.isnot(None))
+    deleted = db.query(models.Image).filter(
+        models.Image.created_at < cutoff,
+        models.Image.content_hash.not_in(referenced)
+    ).delete(synchronize_session=False)
+    db.commit()
+    return deleted
+
+def reap_demo_users(db: Session, max_age_hours: float = DEMO_USER_MAX_AGE_HOURS,
+                    batch_size: int = REAPER_BATCH_SIZE, vacuum_mode: str = REAPER_VACUUM,
+                    on_deleted: Callable[[List[int]], None] = None) -> Dict[str, Any]:
+    """Delete expired public demo users and their data; returns rows deleted per table and bytes reclaimed"""
+    start_time = time.perf_counter()
+    cutoff = datetime.utcnow() - timedelta(hours=max_age_hours)
+    rows = Counter()
+
+    while True:
+        users = db.query(models.User.id, models.User.email).filter(
+            models.User.is_demo.is_(True),
+            models.User.created_at < cutoff
+        ).order_by(models.User.id).limit(batch_size).all()
+        if not users:
+            break
+
+        user_ids = [user.id for user in users]
+        for model in USER_OWNED:
+            rows[model.__tablename__] += db.query(model).filter(
+                model.user_id.in_(user_ids)
+            ).delete(synchronize_session=False)
+        rows[models.User.__tablename__] += db.query(models.User).filter(
+            models.User.id.in_(user_ids)
+        ).delete(synchronize_session=False)
+        db.commit()
+
+        # Bulk deletes skip the User after_delete listener
+        for user in users:
+            invalidate_user(user.email)
+        if on_deleted is not None:
+            on_deleted(user_ids)
+
+    # Also catches images left behind by older releases, which did not delete them with their notes
+    orphaned_images = delete_orphaned_images(db, cutoff)
+    if orphaned_images:
+        rows[models.Image.__tablename__] = orphaned_images
+
+    return {
+        "rows_deleted": dict(rows),
+        "bytes_reclaimed": vacuum(db.get_bind(), vacuum_mode) if rows else 0,
+        "duration_seconds": round(time.perf_counter() - start_time, 3)
+    }
+
+def run_reaper(session_factory, on_deleted: Callable[[List[int]], None] = None, **options) -> Dict[str, Any]:
+    """reap_demo_users on a session of its own"""
+    db = session_factory()
+    try:
+        return reap_demo_users(db, on_deleted=on_deleted, **options)
+    finally:
+        db.close()
+
+async def reap_periodically(session_factory, interval: float = REAPER_INTERVAL_SECONDS,
+                            on_deleted: Callable[[List[int]], None] = None):
+    """Run the reaper every interval seconds, off the event loop, until cancelled"""
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            report = await asyncio.to_thread(run_reaper, session_factory, on_deleted)
+        except Exception as e:
+            print(f"Demo reaper failed: {e}")
+            continue
+        if report["rows_deleted"]:
+            print(f"Reaped expired demo users: {report}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--max-age-hours", type=float, default=DEMO_USER_MAX_AGE_HOURS)
+    parser.add_argument("--batch-size", type=int, default=REAPER_BATCH_SIZE)
+    parser.add_argument("--vacuum", choices=["incremental", "full", "off"], default=REAPER_VACUUM)
+    args = parser.parse_args()
+
+    from database import SessionLocal, create_tables
+    create_tables()
+    print(run_reaper(SessionLocal, max_age_hours=args.max_age_hours, batch_size=args.batch_size,
+                     vacuum_mode=args.vacuum))
+
+if __name__ == "__main__":
+    main()
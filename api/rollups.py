@@ -0,0 +1,124 @@
+"""
+Daily note rollups - per-user, per-day, per-mood counts and energy sums kept
+up to date as notes are written, so insights read a few small rows
+
+Usage:
+    python rollups.py rebuild [--user-id 42]
+"""
+from collections import defaultdict
+from datetime import date, datetime
+from typing import Iterable, Dict, Any, Optional, Tuple
+import argparse
+
+from sqlalchemy import func, insert, select
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.orm import Session
+
+import models
+
+Stats = models.DailyNoteStats
+
+def _day(created_at) -> date:
+    return created_at.date() if isinstance(created_at, datetime) else created_at
+
+def note_deltas(notes: Iterable[Dict[str, Any]], sign: int = 1) -> Dict[Tuple[date, str], list]:
+    """Sum note count and energy changes per (day, mood)"""
+    deltas = defaultdict(lambda: [0, 0, 0])
+    for note in notes:
+        delta = deltas[(_day(note['created_at']), note.get('mood') or "")]
+        delta[0] += sign
+        if note.get('energy_level') is not None:
+            delta[1] += sign * note['energy_level']
+            delta[2] += sign
+    return deltas
+
+def apply_note_deltas(db: Session, user_id: int, notes: Iterable[Dict[str, Any]], sign: int = 1):
+    """Add (sign=1) or remove (sign=-1) notes from the user's rollups, without committing"""
+    rows = [
+        {'user_id': user_id, 'day': day, 'mood': mood,
+         'note_count': note_count, 'energy_sum': energy_sum, 'energy_count': energy_count}
+        for (day, mood), (note_count, energy_sum, energy_count) in note_deltas(notes, sign).items()
+    ]
+    if not rows:
+        return
+
+    dialect = db.get_bind().dialect.name
+    if dialect in ("sqlite", "postgresql"):
+        # Atomic increments, so concurrent writers never lose an update
+        dialect_insert = sqlite.insert if dialect == "sqlite" else postgresql.insert
+        statement = dialect_insert(Stats)
+        db.execute(statement.on_conflict_do_update(
+            index_elements=[Stats.user_id, Stats.day, Stats.mood],
+            set_={
+                'note_count': Stats.note_count + statement.excluded.note_count,
+                'energy_sum': Stats.energy_sum + statement.excluded.energy_sum,
+                'energy_count': Stats.energy_count + statement.excluded.energy_count,
+            }
+        ), rows)
+    else:
+        for row in rows:
+            existing = db.query(Stats).filter(
+                Stats.user_id == user_id, Stats.day == row['day'], Stats.mood == row['mood']
+            ).with_for_update().first()
+            if existing is None:
+                db.add(Stats(**row))
+            else:
+                existing.note_count += row['note_count']
+                existing.energy_sum += row['energy_sum']
+                existing.energy_count += row['energy_count']
+        db.flush()
+
+    if sign < 0:
+        db.query(Stats).filter(Stats.user_id == user_id, Stats.note_count <= 0).delete(synchronize_session=False)
+
+def note_as_dict(note: models.Note) -> Dict[str, Any]:
+    return {'created_at': note.created_at, 'mood': note.mood, 'energy_level': note.energy_level}
+
+def clear_rollups(db: Session, user_id: int):
+    """Drop a user's rollups, e.g. when all their notes are deleted, without committing"""
+    db.query(Stats).filter(Stats.user_id == user_id).delete(synchronize_session=False)
+
+def rebuild_rollups(db: Session, user_id: Optional[int] = None) -> int:
+    """Recompute rollups from the notes table for one user or everyone; returns rows written"""
+    query = db.query(Stats)
+    notes_filter = []
+    if user_id is not None:
+        query = query.filter(Stats.user_id == user_id)
+        notes_filter.append(models.Note.user_id == user_id)
+    query.delete(synchronize_session=False)
+
+    day = func.date(models.Note.created_at)
+    mood = func.coalesce(models.Note.mood, "")
+    aggregated = select(
+        models.Note.user_id,
+        day,
+        mood,
+        func.count(models.Note.id),
+        func.coalesce(func.sum(models.Note.energy_level), 0),
+        func.count(models.Note.energy_level)
+    ).where(models.Note.user_id.isnot(None), *notes_filter).group_by(models.Note.user_id, day, mood)
+
+    result = db.execute(insert(Stats).from_select(
+        ['user_id', 'day', 'mood', 'note_count', 'energy_sum', 'energy_count'], aggregated
+    ))
+    db.commit()
+    return result.rowcount
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    rebuild = subparsers.add_parser("rebuild", help="recompute rollups from notes")
+    rebuild.add_argument("--user-id", type=int, help="only rebuild this user's rollups")
+    args = parser.parse_args()
+
+    from database import SessionLocal, create_tables
+    create_tables()
+    db = SessionLocal()
+    try:
+        rows = rebuild_rollups(db, args.user_id)
+        print(f"Rebuilt {rows} rollup rows")
+    finally:
+        db.close()
+
+if __name__ == "__main__":
+    main()
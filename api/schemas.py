@@ -1,8 +1,10 @@
-from pydantic import BaseModel, EmailStr
+from pydantic import BaseModel, EmailStr, field_validator
 from datetime import datetime
-from typing import Optional, List
+from typing import Optional, List, Dict
 from enum import Enum
 
+from images import parse_image_data
+
 class UserCreate(BaseModel):
     email: EmailStr
     password: str
@@ -28,7 +30,53 @@ class NoteCreate(BaseModel):
     content: str
     mood: Optional[str] = "😐"
     energy_level: Optional[int] = 3
-    image_data: Optional[str] = None
+    image_data: Optional[str] = None  # base64, optionally as a data: URL
+    
+    @field_validator("mood", "energy_level", mode="before")
+    @classmethod
+    def null_takes_default(cls, value, info):
+        # An explicit null stores the same default as an omitted field
+        return cls.model_fields[info.field_name].default if value is None else value
+    
+    @field_validator("image_data")
+    @classmethod
+    def image_data_is_base64(cls, value):
+        if value:
+            parse_image_data(value)
+        return value
+
+class NoteImport(NoteCreate):
+    # Imported journal entries keep their original date
+    created_at: Optional[datetime] = None
+
+class BulkImportResult(BaseModel):
+    index: int
+    status: str  # created/error
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+class BulkImportResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkImportResult]
+
+class MomentImport(BaseModel):
+    title: str
+    summary: str
+    emotional_tone: str
+    emotional_score: float
+    keywords: List[str]
+    reflection_prompt: str
+    start_date: datetime
+    end_date: datetime
+    note_count: int
+    note_ids: List[int]  # ids from the export, remapped on import
+
+class AccountImportResponse(BaseModel):
+    notes_created: int
+    moments_created: int
+    failed: int
+    errors: List[BulkImportResult]  # only the lines that failed
 
 class NoteUpdate(BaseModel):
     title: Optional[str] = None
@@ -37,19 +85,22 @@ class NoteUpdate(BaseModel):
     energy_level: Optional[int] = None
     image_data: Optional[str] = None
 
-class Note(BaseModel):
+class NoteSummary(BaseModel):
     id: int
     title: str
     content: str
-    mood: str
-    energy_level: int
-    image_data: Optional[str]
+    mood: Optional[str] = None  # null on notes stored before imports filled in defaults
+    energy_level: Optional[int] = None
+    image_url: Optional[str] = None  # GET it for the image bytes
     created_at: datetime
     updated_at: datetime
     
     class Config:
         from_attributes = True
 
+class Note(NoteSummary):
+    image_data: Optional[str] = None  # only notes not yet moved to the image store
+
 class EmotionalTone(str, Enum):
     POSITIVE = "Positive"
     NEUTRAL = "Neutral"
@@ -76,8 +127,12 @@ class AnalysisRequest(BaseModel):
     start_date: Optional[datetime] = None
     end_date: Optional[datetime] = None
     min_cluster_size: Optional[int] = 2
+    incremental: Optional[bool] = False
+    include_timings: Optional[bool] = False
 
 class AnalysisResponse(BaseModel):
     moments: List[Moment]
     total_notes_analyzed: int
-    analysis_time: float
\ No newline at end of file
+    analysis_time: float
+    cache_hit: bool = False
+    timings: Optional[Dict[str, float]] = None
\ No newline at end of file
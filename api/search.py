@@ -0,0 +1,96 @@
+"""
+Full-text note search - an SQLite FTS5 index over note titles and contents,
+kept in sync by triggers, with a LIKE fallback for other databases
+"""
+from typing import Optional, Union
+import re
+
+from sqlalchemy import Select, column, table, text
+from sqlalchemy.engine import Engine
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Query, Session
+
+import models
+
+# External-content table: the index stores only tokens, rows live in notes
+FTS_SCHEMA = [
+    """
+    CREATE VIRTUAL TABLE IF NOT EXISTS notes_fts USING fts5(
+        title, content,
+        content='notes', content_rowid='id',
+        tokenize='unicode61 remove_diacritics 2',
+        prefix='2 3'
+    )
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS notes_fts_insert AFTER INSERT ON notes BEGIN
+        INSERT INTO notes_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS notes_fts_delete AFTER DELETE ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS notes_fts_update AFTER UPDATE OF title, content ON notes BEGIN
+        INSERT INTO notes_fts(notes_fts, rowid, title, content) VALUES ('delete', old.id, old.title, old.content);
+        INSERT INTO notes_fts(rowid, title, content) VALUES (new.id, new.title, new.content);
+    END
+    """,
+]
+
+# Title matches count for more than content matches when ranking
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+
+notes_fts = table("notes_fts", column("rowid"))
+
+# Engines the FTS index was created on
+_fts_engines = set()
+
+def create_search_index(engine: Engine) -> bool:
+    """Create the FTS index and its triggers; False if the database cannot host one"""
+    if engine.dialect.name != "sqlite":
+        return False
+
+    with engine.begin() as conn:
+        exists = conn.execute(
+            text("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'notes_fts'")
+        ).first() is not None
+        try:
+            for statement in FTS_SCHEMA:
+                conn.execute(text(statement))
+        except Exception as e:
+            # SQLite built without FTS5
+            print(f"Full-text search unavailable, falling back to LIKE: {e}")
+            return False
+        if not exists:
+            # Index notes written before the table existed
+            conn.execute(text("INSERT INTO notes_fts(notes_fts) VALUES ('rebuild')"))
+
+    register_search_index(engine)
+    return True
+
+def register_search_index(engine: Engine):
+    """Search through the FTS index on engine, e.g. an async engine's sync_engine for the same database"""
+    _fts_engines.add(engine)
+
+def fts_query(search: str) -> Optional[str]:
+    """Prefix-match every word of the search, e.g. 'deep wor' -> '"deep"* "wor"*'"""
+    words = re.findall(r"\w+", search.lower())
+    if not words:
+        return None
+    return " ".join(f'"{word}"*' for word in words)
+
+def search_notes(db: Union[Session, AsyncSession], query: Union[Query, Select], search: str) -> Union[Query, Select]:
+    """Restrict a Note query or select() to matches for search, best matches first"""
+    match = fts_query(search)
+    if db.get_bind() in _fts_engines and match is not None:
+        return query.join(notes_fts, notes_fts.c.rowid == models.Note.id).filter(
+            text("notes_fts MATCH :fts_query").bindparams(fts_query=match)
+        ).order_by(text(f"bm25(notes_fts, {TITLE_WEIGHT}, {CONTENT_WEIGHT})"))
+
+    return query.filter(
+        (models.Note.title.contains(search)) | (models.Note.content.contains(search))
+    )
@@ -0,0 +1,59 @@
+from sqlalchemy import insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.orm import Session
+from typing import List, Dict, Any
+import hashlib
+
+import models
+
+# Stay well below SQLite's bound-parameter limit for IN (...) lookups
+LOOKUP_CHUNK_SIZE = 500
+
+def sentiment_key(text: str) -> str:
+    """Content hash a text's stored polarity is keyed by"""
+    return hashlib.md5(text.encode()).hexdigest()
+
+def load_polarities(db: Session, notes: List[Dict[str, Any]]):
+    """Attach stored polarities to notes whose current text has been scored before"""
+    keys = [sentiment_key(f"{note['title']} {note['content']}") for note in notes]
+    
+    stored = {}
+    distinct_keys = list(set(keys))
+    for i in range(0, len(distinct_keys), LOOKUP_CHUNK_SIZE):
+        chunk = distinct_keys[i:i + LOOKUP_CHUNK_SIZE]
+        rows = db.query(models.NoteSentiment.content_hash, models.NoteSentiment.polarity).filter(
+            models.NoteSentiment.content_hash.in_(chunk)
+        )
+        stored.update({row.content_hash: row.polarity for row in rows})
+    
+    for note, key in zip(notes, keys):
+        if key in stored:
+            note['polarity'] = stored[key]
+
+def store_polarities(db: Session, scores: Dict[str, float]):
+    """Insert newly computed polarities in one batch"""
+    if not scores:
+        return
+    
+    rows = [{'content_hash': key, 'polarity': polarity} for key, polarity in scores.items()]
+    try:
+        db.execute(insert(models.NoteSentiment), rows)
+        db.commit()
+    except IntegrityError:
+        # Another request scored some of the same texts; keep what is missing
+        db.rollback()
+        existing = set()
+        for i in range(0, len(rows), LOOKUP_CHUNK_SIZE):
+            chunk = [row['content_hash'] for row in rows[i:i + LOOKUP_CHUNK_SIZE]]
+            existing.update(row.content_hash for row in db.query(models.NoteSentiment.content_hash).filter(
+                models.NoteSentiment.content_hash.in_(chunk)
+            ))
+        missing = [row for row in rows if row['content_hash'] not in existing]
+        if missing:
+            db.execute(insert(models.NoteSentiment), missing)
+        db.commit()
+
+def attach_polarities(db: Session, notes: List[Dict[str, Any]], analyzer):
+    """Give every note a polarity, scoring only note versions never seen before"""
+    load_polarities(db, notes)
+    store_polarities(db, analyzer.fill_polarities(notes))
@@ -0,0 +1,138 @@
+"""
+Authenticated user cache - token subject to a small user record, so
+authenticated requests skip the users table while the entry is fresh
+"""
+from collections import OrderedDict
+from datetime import datetime
+from typing import NamedTuple, Optional
+import json
+import os
+import threading
+import time
+
+from sqlalchemy import event
+
+import models
+
+USER_CACHE_BACKEND = os.getenv("USER_CACHE_BACKEND", "memory")
+USER_CACHE_TTL_SECONDS = float(os.getenv("USER_CACHE_TTL_SECONDS", "300"))
+USER_CACHE_MAX_ENTRIES = int(os.getenv("USER_CACHE_MAX_ENTRIES", "10000"))
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+class CachedUser(NamedTuple):
+    """The user fields requests need, detached from any session"""
+    id: int
+    email: str
+    created_at: datetime
+
+    @classmethod
+    def from_model(cls, user: models.User) -> "CachedUser":
+        return cls(user.id, user.email, user.created_at)
+
+class NullUserCache:
+    """Caches nothing; every request reads the users table"""
+    blocking = False
+
+    def get(self, email: str) -> Optional[CachedUser]:
+        return None
+
+    def set(self, user: CachedUser):
+        pass
+
+    def invalidate(self, email: str):
+        pass
+
+class MemoryUserCache:
+    """Per-process LRU cache whose entries expire ttl seconds after they are stored"""
+    blocking = False
+
+    def __init__(self, max_entries: int = USER_CACHE_MAX_ENTRIES, ttl: float = USER_CACHE_TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, email: str) -> Optional[CachedUser]:
+        with self._lock:
+            entry = self._entries.get(email)
+            if entry is None:
+                return None
+            user, expires_at = entry
+            if expires_at <= time.monotonic():
+                del self._entries[email]
+                return None
+            self._entries.move_to_end(email)
+            return user
+
+    def set(self, user: CachedUser):
+        with self._lock:
+            self._entries[user.email] = (user, time.monotonic() + self.ttl)
+            self._entries.move_to_end(user.email)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, email: str):
+        with self._lock:
+            self._entries.pop(email, None)
+
+    def __len__(self):
+        return len(self._entries)
+
+class RedisUserCache:
+    """Cache shared by every worker through Redis; errors count as misses"""
+    # Calls go over the network, so async callers run them in the threadpool
+    blocking = True
+
+    def __init__(self, url: str = REDIS_URL, ttl: float = USER_CACHE_TTL_SECONDS, prefix: str = "echotrail:user:"):
+        try:
+            import redis
+        except ImportError:
+            raise RuntimeError("USER_CACHE_BACKEND=redis needs the redis package: pip install redis")
+        self.client = redis.Redis.from_url(url, socket_timeout=0.5, socket_connect_timeout=0.5)
+        self.ttl = ttl
+        self.prefix = prefix
+
+    def get(self, email: str) -> Optional[CachedUser]:
+        try:
+            value = self.client.get(self.prefix + email)
+        except Exception as e:
+            print(f"User cache read failed: {e}")
+            return None
+        if value is None:
+            return None
+        user_id, cached_email, created_at = json.loads(value)
+        return CachedUser(user_id, cached_email, datetime.fromisoformat(created_at))
+
+    def set(self, user: CachedUser):
+        value = json.dumps([user.id, user.email, user.created_at.isoformat()])
+        try:
+            self.client.set(self.prefix + user.email, value, px=int(self.ttl * 1000))
+        except Exception as e:
+            print(f"User cache write failed: {e}")
+
+    def invalidate(self, email: str):
+        try:
+            self.client.delete(self.prefix + email)
+        except Exception as e:
+            print(f"User cache invalidation failed for {email}: {e}")
+
+def create_user_cache(backend: str = USER_CACHE_BACKEND):
+    """User cache for a USER_CACHE_BACKEND name: memory, redis or off"""
+    if backend == "memory":
+        return MemoryUserCache()
+    if backend == "redis":
+        return RedisUserCache()
+    if backend == "off":
+        return NullUserCache()
+    raise ValueError(f"Unknown USER_CACHE_BACKEND '{backend}', expected memory, redis or off")
+
+user_cache = create_user_cache()
+
+def invalidate_user(email: str):
+    """Drop a user from the cache, e.g. after deleting them with a bulk query"""
+    user_cache.invalidate(email)
+
+@event.listens_for(models.User, "after_delete")
+def invalidate_deleted_user(mapper, connection, target):
+    # Session.delete(user) fires this; bulk query deletes must call invalidate_user
+    invalidate_user(target.email)
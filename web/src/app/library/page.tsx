@@ -18,6 +18,8 @@ export default function LibraryPage() {
   const [loading, setLoading] = useState(true)
   const [searchTerm, setSearchTerm] = useState('')
   const [selectedMood, setSelectedMood] = useState('')
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  const [loadingMore, setLoadingMore] = useState(false)
   
   const { isAuthenticated } = useAuth()
 
@@ -27,16 +29,18 @@ export default function LibraryPage() {
     }
   }, [isAuthenticated])
 
-  const fetchNotes = async () => {
+  const fetchNotes = async (cursor?: string) => {
     try {
       const response = await api.get<Note[]>('/notes', {
         params: {
           search: searchTerm || undefined,
           mood: selectedMood || undefined,
-          limit: 50
+          limit: 50,
+          cursor
         }
       })
-      setNotes(response.data)
+      setNotes(cursor ? [...notes, ...response.data] : response.data)
+      setNextCursor(response.headers['x-next-cursor'] || null)
     } catch (error) {
       console.error('Failed to fetch notes:', error)
     } finally {
@@ -44,6 +48,13 @@ export default function LibraryPage() {
     }
   }
 
+  const loadMore = async () => {
+    if (!nextCursor) return
+    setLoadingMore(true)
+    await fetchNotes(nextCursor)
+    setLoadingMore(false)
+  }
+
   const handleDelete = async (noteId: number) => {
     if (!confirm('Are you sure you want to delete this note?')) return
     
@@ -233,6 +244,14 @@ export default function LibraryPage() {
             </div>
           )}
 
+          {nextCursor && !loading && (
+            <div className="flex justify-center mt-6">
+              <Button variant="outline" onClick={loadMore} disabled={loadingMore}>
+                {loadingMore ? 'Loading...' : 'Load more'}
+              </Button>
+            </div>
+          )}
+
           {/* Stats */}
           {notes.length > 0 && (
             <Card className="mt-8 bg-primary/5 border-primary/20">
@@ -18,6 +18,8 @@ export default function MomentsPage() {
   const [analyzing, setAnalyzing] = useState(false)
   const [lastAnalysis, setLastAnalysis] = useState<AnalysisResponse | null>(null)
   const [showDemoNotice, setShowDemoNotice] = useState(false)
+  const [nextCursor, setNextCursor] = useState<string | null>(null)
+  const [loadingMore, setLoadingMore] = useState(false)
   
   const { isAuthenticated } = useAuth()
   const router = useRouter()
@@ -34,11 +36,17 @@ export default function MomentsPage() {
     }
   }, [isAuthenticated, isDemoMode])
 
-  const fetchMoments = async () => {
-    setLoading(true)
+  const fetchMoments = async (cursor?: string) => {
+    if (!cursor) setLoading(true)
     try {
-      const response = await api.get<Moment[]>('/moments')
-      setMoments(response.data)
+      const response = await api.get<Moment[]>('/moments', {
+        params: {
+          limit: 50,
+          cursor
+        }
+      })
+      setMoments(cursor ? [...moments, ...response.data] : response.data)
+      setNextCursor(response.headers['x-next-cursor'] || null)
     } catch (error) {
       console.error('Failed to fetch moments:', error)
     } finally {
@@ -46,6 +54,13 @@ export default function MomentsPage() {
     }
   }
 
+  const loadMore = async () => {
+    if (!nextCursor) return
+    setLoadingMore(true)
+    await fetchMoments(nextCursor)
+    setLoadingMore(false)
+  }
+
   const runAnalysis = async () => {
     setAnalyzing(true)
     try {
@@ -53,7 +68,9 @@ export default function MomentsPage() {
         min_cluster_size: 2
       })
       setLastAnalysis(response.data)
+      // The analysis returns every moment, so there is nothing left to page through
       setMoments(response.data.moments)
+      setNextCursor(null)
     } catch (error) {
       console.error('Failed to run analysis:', error)
     } finally {
@@ -308,6 +325,14 @@ export default function MomentsPage() {
             </div>
           )}
 
+          {nextCursor && !loading && (
+            <div className="flex justify-center mt-6">
+              <Button variant="outline" onClick={loadMore} disabled={loadingMore}>
+                {loadingMore ? 'Loading...' : 'Load more'}
+              </Button>
+            </div>
+          )}
+
           {/* Help Card */}
           <Card className="mt-8 bg-primary/5 border-primary/20">
             <CardContent className="pt-6">
@@ -10,6 +10,7 @@ export interface Note {
   content: string;
   mood: string;
   energy_level: number;
+  image_url?: string | null;
   image_data?: string;
   created_at: string;
   updated_at: string;
@@ -50,12 +51,16 @@ export interface AnalysisRequest {
   start_date?: string;
   end_date?: string;
   min_cluster_size?: number;
+  incremental?: boolean;
+  include_timings?: boolean;
 }
 
 export interface AnalysisResponse {
   moments: Moment[];
   total_notes_analyzed: number;
   analysis_time: number;
+  cache_hit?: boolean;
+  timings?: Record<string, number>;
 }
 
 export interface InsightsStats {